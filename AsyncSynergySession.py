@@ -0,0 +1,452 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+AsyncSynergySession.py
+
+Non-blocking Synergy sessions: run() returns a future instead of the result, and all
+outstanding commands of a pool are driven by a single event loop thread.
+
+Copyright (c) 2011 Nokia. All rights reserved.
+"""
+
+import os
+import time
+import heapq
+import select
+from itertools import count
+from collections import deque
+from threading import Thread, Lock, Condition, BoundedSemaphore
+from subprocess import Popen, PIPE
+
+import SynergySession
+from RetryPolicy import RetryPolicy
+from SynergyMetrics import MetricsRegistry
+
+
+class CommandFuture(object):
+    """The eventual result of a Synergy command"""
+
+    def __init__(self):
+        self._condition = Condition()
+        self._done = False
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done
+
+    def result(self, timeout=None):
+        """Wait for the command to finish and return its parsed result"""
+        with self._condition:
+            if not self._done:
+                self._condition.wait(timeout)
+            if not self._done:
+                raise SynergySession.SynergyException('Timeout while waiting for a Synergy command')
+        if self._exception:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        with self._condition:
+            if not self._done:
+                self._condition.wait(timeout)
+            if not self._done:
+                raise SynergySession.SynergyException('Timeout while waiting for a Synergy command')
+        return self._exception
+
+    def add_done_callback(self, fn):
+        """Call fn(future) when the command is finished; immediately if it already is"""
+        with self._condition:
+            if not self._done:
+                self._callbacks.append(fn)
+                return
+        self._call(fn)
+
+    def set_result(self, result):
+        self._finish(result, None)
+
+    def set_exception(self, exception):
+        self._finish(None, exception)
+
+    def _finish(self, result, exception):
+        with self._condition:
+            self._result = result
+            self._exception = exception
+            self._done = True
+            self._condition.notify_all()
+            callbacks = self._callbacks
+            self._callbacks = []
+        for fn in callbacks:
+            self._call(fn)
+
+    def _call(self, fn):
+        """Callbacks run on the loop thread, an error in one must not stop the loop"""
+        try:
+            fn(self)
+        except Exception, e:
+            print "Error in the callback of a Synergy command:", repr(e)
+
+
+class _Job(object):
+    """A command waiting for, or running in, a ccm process"""
+
+    def __init__(self, session, command, status, future):
+        self.session = session
+        self.command = command
+        self.status = status
+        self.future = future
+        self.attempts = 0
+        self.start = None
+        self.process = None
+        self.stdout = []
+        self.stderr = []
+
+
+class CommandLoop(object):
+    """Runs ccm processes for any number of sessions from one thread.
+
+    At most max_in_flight processes run at the same time; the rest wait in a queue"""
+
+    def __init__(self, max_in_flight=10):
+        self.slots = BoundedSemaphore(max_in_flight)
+        self.pending = deque()
+        self.running = {}
+        # failed jobs waiting for their retry, as a heap of (due time, sequence number, job)
+        self.delayed = []
+        self.sequence = count()
+        self.lock = Lock()
+        # writing to this pipe wakes up the loop when new work arrives
+        self.wake_r, self.wake_w = os.pipe()
+        self.stopped = False
+        # set when the loop has ended, new commands fail right away then
+        self.failure = None
+        self.t = Thread(target=self._loop)
+        self.t.daemon = True
+        self.t.start()
+
+    def submit(self, session, command, status):
+        future = CommandFuture()
+        with self.lock:
+            failure = self.failure
+            if not failure:
+                self.pending.append(_Job(session, command, status, future))
+        if failure:
+            future.set_exception(failure)
+            return future
+        os.write(self.wake_w, 'x')
+        return future
+
+    def stop(self):
+        self.stopped = True
+        os.write(self.wake_w, 'x')
+        self.t.join()
+
+    def _launch(self):
+        """Start pending jobs while there are free slots"""
+        while True:
+            with self.lock:
+                if not self.pending:
+                    return
+                if not self.slots.acquire(False):
+                    return
+                job = self.pending.popleft()
+            job.attempts += 1
+            if job.start is None:
+                job.start = time.time()
+            job.stdout = []
+            job.stderr = []
+            if job.session.backend:
+                # backends answer in process, there is nothing to wait for
+                job.session.num_of_cmds += 1
+                try:
+                    stdout, stderr = job.session.backend.execute(job.command, job.session.environment)
+                except Exception, e:
+                    self.slots.release()
+                    job.future.set_exception(SynergySession.SynergyException('Error while running the Synergy command: %s \nError message: %s' % (job.command, e)))
+                    continue
+                self.slots.release()
+                self._finish(job, stdout, stderr)
+                continue
+            try:
+                job.process = Popen(job.command, stdout=PIPE, stderr=PIPE, env=job.session.environment)
+            except OSError, e:
+                self.slots.release()
+                job.future.set_exception(SynergySession.SynergyException('Error while running the Synergy command: %s \nError message: %s' % (job.command, e)))
+                continue
+            job.session.num_of_cmds += 1
+            self.running[job.process.stdout.fileno()] = (job, job.stdout)
+            self.running[job.process.stderr.fileno()] = (job, job.stderr)
+
+    def _loop(self):
+        """Drive the commands until stopped; whatever ends the loop fails the commands left"""
+        failure = SynergySession.SynergyException('The Synergy command loop was stopped')
+        try:
+            self._serve()
+        except Exception, e:
+            failure = SynergySession.SynergyException('The Synergy command loop failed: %r' % e)
+        self._fail_all(failure)
+
+    def _fail_all(self, failure):
+        with self.lock:
+            self.failure = failure
+            jobs = list(self.pending) + [job for delay, sequence, job in self.delayed]
+            self.pending.clear()
+            self.delayed = []
+        for job, buf in self.running.values():
+            if job not in jobs:
+                jobs.append(job)
+                try:
+                    job.process.kill()
+                    job.process.wait()
+                except OSError:
+                    pass
+        self.running = {}
+        for job in jobs:
+            if not job.future.done():
+                job.future.set_exception(failure)
+
+    def _serve(self):
+        while not self.stopped:
+            timeout = None
+            while self.delayed:
+                due = self.delayed[0][0] - time.time()
+                if due > 0:
+                    timeout = due
+                    break
+                with self.lock:
+                    self.pending.append(heapq.heappop(self.delayed)[2])
+            self._launch()
+            fds = [self.wake_r] + self.running.keys()
+            ready = select.select(fds, [], [], timeout)[0]
+            for fd in ready:
+                if fd == self.wake_r:
+                    os.read(self.wake_r, 4096)
+                    continue
+                job, buf = self.running[fd]
+                data = os.read(fd, 65536)
+                if data:
+                    buf.append(data)
+                    continue
+                del self.running[fd]
+                if job.process.stdout.fileno() not in self.running and job.process.stderr.fileno() not in self.running:
+                    self._complete(job)
+
+    def _complete(self, job):
+        job.process.wait()
+        job.process.stdout.close()
+        job.process.stderr.close()
+        self.slots.release()
+        self._finish(job, ''.join(job.stdout), ''.join(job.stderr))
+
+    def _finish(self, job, stdout, stderr):
+        """Retry the job or hand its result to the future; any error finishing it goes to the future too"""
+        try:
+            self._settle(job, stdout, stderr)
+        except Exception, e:
+            if not job.future.done():
+                job.future.set_exception(e)
+
+    def _settle(self, job, stdout, stderr):
+        retries = job.attempts - 1
+        if stderr:
+            policy = job.session.retry_policy
+            if policy.should_retry(policy.classify(stderr), retries):
+                heapq.heappush(self.delayed, (time.time() + policy.delay(retries), next(self.sequence), job))
+                return
+        job.session.metrics.record(job.session.sessionID, job.command[1], time.time() - job.start, retries, len(stdout), bool(stderr))
+        if stderr:
+            job.future.set_exception(SynergySession.SynergyException('Error while running the Synergy command: %s \nError message: %s' % (job.command, stderr)))
+            return
+        result = job.session._parse_result(job.command, job.status, stdout)
+        job.future.set_result(result)
+
+
+class AsyncSynergySession(SynergySession.SynergySession):
+    """A Synergy session where run() returns a CommandFuture.
+
+    Commands are built exactly as with SynergySession, i.e.
+    future = session.query("...").format("%objectname").run()
+    result = future.result()"""
+
+    def __init__(self, database, engine=None, command_name='ccm', ccm_ui_path='/dev/null', ccm_eng_path='/dev/null', loop=None, retry_policy=None, metrics=None, backend=None):
+        self.loop = loop
+        super(AsyncSynergySession, self).__init__(database, engine, command_name, ccm_ui_path, ccm_eng_path, False, retry_policy, metrics, backend)
+        if self.loop is None:
+            self.loop = CommandLoop()
+
+    def run(self):
+        """Queue the Synergy command and return a CommandFuture for its result"""
+        command = self._build_command()
+        status = self.status
+        self._reset_status()
+        return self.loop.submit(self, command, status)
+
+    def query_many(self, keys, template, format=(), key_token=None, row_token=None, strip=True):
+        """As SynergySession.query_many, but all combined queries are outstanding at once.
+
+        Returns a CommandFuture for the dictionary with the list of rows for every key"""
+        template, row_token = self._query_many_tokens(template, key_token, row_token)
+        results = {}
+        for key in keys:
+            results[key] = []
+        chunks = self._query_chunks(results.keys(), template, key_token)
+        future = CommandFuture()
+        if not chunks:
+            future.set_result(results)
+            return future
+        lock = Lock()
+        # chunks still to come, and whether the future was given its outcome
+        remaining = [len(chunks)]
+        settled = [False]
+
+        def chunk_done(chunk, f):
+            with lock:
+                if settled[0]:
+                    return
+                exception = f.exception()
+                if not exception:
+                    try:
+                        self._demultiplex(results, chunk, f.result(), key_token, row_token)
+                    except Exception, e:
+                        exception = e
+                remaining[0] -= 1
+                settled[0] = bool(exception) or not remaining[0]
+                if not settled[0]:
+                    return
+            if exception:
+                future.set_exception(exception)
+            else:
+                future.set_result(results)
+
+        for chunk in chunks:
+            self._chunk_query(chunk, template, format, strip).run().add_done_callback(lambda f, chunk=chunk: chunk_done(chunk, f))
+        return future
+
+    def start(self):
+        raise SynergySession.SynergyException('AsyncSynergySession runs every command in the background already, use run()')
+
+
+class AsyncSynergySessions(object):
+    """A pool of asynchronous Synergy sessions sharing one command loop.
+
+    Any number of commands can be outstanding; max_in_flight bounds the ccm processes running at once"""
+
+    def __init__(self, database, engine=None, command_name='ccm', ccm_ui_path='/dev/null', ccm_eng_path='/dev/null', nr_sessions=2, max_in_flight=None, retry_policy=None, metrics=None, backend=None):
+        self.database = database
+        self.nr_sessions = nr_sessions
+        self.max_session_index = nr_sessions-1
+        if max_in_flight is None:
+            max_in_flight = nr_sessions
+        self.loop = CommandLoop(max_in_flight)
+        self.next_index = 0
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.metrics = metrics or MetricsRegistry()
+
+        self.sessionArray = {}
+        for i in range(self.nr_sessions):
+            print "starting session [" + str(i) + "]"
+            self.sessionArray[i] = AsyncSynergySession(database, engine, command_name, ccm_ui_path, ccm_eng_path, self.loop, self.retry_policy, self.metrics, backend)
+            self.sessionArray[i].setSessionID(i)
+
+    def __getitem__(self, index):
+        if ((index > self.max_session_index) or (index < 0)):
+            raise IndexError()
+        return self.sessionArray[index]
+
+    def session(self):
+        """Returns the sessions round robin, to spread the commands over the pool"""
+        session = self.sessionArray[self.next_index]
+        self.next_index = (self.next_index + 1) % self.nr_sessions
+        return session
+
+    def query(self, query_string):
+        """Start building a query on the next session of the pool"""
+        return self.session().query(query_string)
+
+    def __str__(self):
+        retstring = ''
+        for i in range(self.nr_sessions):
+            retstring = retstring + "[" + str(i) + "] " + self.sessionArray[i].getCCM_ADDR() + "\n"
+        return retstring
+
+
+def test_synthetic(latency=0.02):
+    """Test: drive the command loop against synthetic_ccm.py run as the ccm executable.
+
+    Many commands and a query_many are outstanding at once and must give the answers of a
+    synchronous session; failing commands, parsers, backends and callbacks must fail their own
+    future only and leave the loop running"""
+    import tempfile
+    from synthetic_ccm import SyntheticDatabase, SyntheticBackend
+
+    class FailingBackend(SyntheticBackend):
+        def execute(self, command, environment):
+            if command[1] == 'query':
+                raise ValueError('backend failure')
+            return SyntheticBackend.execute(self, command, environment)
+
+    db = SyntheticDatabase(objects=40)
+    fd, fname = tempfile.mkstemp(suffix='.p')
+    os.close(fd)
+    db.save(fname)
+    os.environ['SYNTHETIC_CCM_DB'] = fname
+    os.environ['SYNTHETIC_CCM_LATENCY'] = str(latency)
+    command_name = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'synthetic_ccm.py')
+    try:
+        ccmpool = AsyncSynergySessions('synthetic', command_name=command_name, nr_sessions=2, max_in_flight=4)
+        ccm = SynergySession.SynergySession('synthetic', backend=SyntheticBackend(db))
+        objects = sorted(db.objects)[:20]
+        template = "is_predecessor_of('{0}')"
+
+        futures = [(o, ccmpool.query(template.format(o)).format('%name').run()) for o in objects]
+        failed = ccmpool.query("no_such_function('x')").run()
+        for o, f in futures:
+            assert f.result(60) == ccm.query(template.format(o)).format('%name').run(), o
+        assert isinstance(failed.exception(60), SynergySession.SynergyException)
+
+        def broken_callback(f):
+            raise RuntimeError('broken callback')
+        f = ccmpool.query(template.format(objects[0])).run()
+        f.add_done_callback(broken_callback)
+        f.result(60)
+
+        session = ccmpool.session()
+        session._parse_result = lambda command, status, result: [][0]
+        assert isinstance(session.query("type='project'").run().exception(60), IndexError)
+        del session._parse_result
+
+        failing = AsyncSynergySession('synthetic', loop=ccmpool.loop, backend=FailingBackend(db))
+        assert isinstance(failing.query("type='project'").run().exception(60), SynergySession.SynergyException)
+
+        key_token = lambda o: (db.objects[o]['name'], db.objects[o]['type'])
+        many = ccmpool.session().query_many(objects, template, ['%name'], key_token, lambda row: key_token(row['objectname']))
+        assert many.result(60) == ccm.query_many(objects, template, ['%name'], key_token)
+
+        ccmpool.loop.stop()
+        assert isinstance(ccmpool.query("type='project'").run().exception(1), SynergySession.SynergyException)
+        print "command loop test passed,", ccmpool.session().num_of_cmds + ccmpool.session().num_of_cmds, "commands"
+        # the sessions stop while the database is still there
+        del ccmpool, session, failing, ccm
+    finally:
+        os.remove(fname)
+
+def main():
+    """Test: ask for the objects of a bunch of random tasks, all at once; with --synthetic against a synthetic database"""
+    import sys
+    import random
+    from datetime import datetime
+    if sys.argv[1:] == ['--synthetic']:
+        test_synthetic()
+        return
+    ccmpool = AsyncSynergySessions(database='/nokia/co_nmp/groups/gscm/dbs/co1asset', nr_sessions=2)
+
+    tstart = datetime.now()
+    futures = [ccmpool.query("is_associated_cv_of(task('co1asset#%i'))" % random.randint(1000, 100000)).format("%objectname").run() for i in range(11)]
+    for f in futures:
+        print f.result()
+    print "11 operations took: " + str((datetime.now()-tstart).seconds) + " seconds"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+BlobStore.py
+
+A content-addressed store of compressed file contents, shared by all releases
+
+Copyright (c) 2011 Nokia. All rights reserved.
+"""
+
+import os
+import zlib
+import difflib
+import hashlib
+import cPickle
+import tempfile
+from threading import Lock
+
+class BlobStore(object):
+    """Contents by sha1 in root/objects, and an index from objectname to sha1 in root/index.
+
+    root is named after the output of a run, i.e. <output>_blobs, and created when the first
+    content is stored.
+
+    Every content is stored once however many object versions and releases share it. With
+    deltas=True a content is stored as the line differences to the content of another version
+    of the file, as long as that one is not at the end of a chain of max_chain deltas already"""
+
+    def __init__(self, root, deltas=False, max_chain=16):
+        self.root = root
+        self.deltas = deltas
+        self.max_chain = max_chain
+        self.lock = Lock()
+        self.index = {}
+        # sha1 -> length of the delta chain, 0 for full contents
+        self.depth = {}
+        self.skipped = 0
+        self.stored = 0
+        self.deduplicated = 0
+        self.bytes_written = 0
+        self._load_index()
+
+    def _load_index(self):
+        fname = os.path.join(self.root, 'index')
+        if not os.path.isfile(fname):
+            return
+        f = open(fname, 'rb')
+        for line in f:
+            objectname, tab, sha1 = line.rstrip('\n').rpartition('\t')
+            # a line cut short by an interrupted run is ignored
+            if tab and len(sha1) == 40:
+                self.index[objectname] = sha1
+        f.close()
+
+    def _path(self, sha1):
+        return os.path.join(self.root, 'objects', sha1[:2], sha1[2:])
+
+    def has(self, objectname):
+        with self.lock:
+            return objectname in self.index
+
+    def skip(self):
+        """Count a cat which was not needed because the content was present"""
+        with self.lock:
+            self.skipped += 1
+
+    def put(self, objectname, content, base=None):
+        """Store the content of the object version, as a delta to the content of base if possible. Returns its sha1"""
+        sha1 = hashlib.sha1(content).hexdigest()
+        with self.lock:
+            known = objectname in self.index
+            exists = sha1 in self.depth or os.path.isfile(self._path(sha1))
+            base_sha1 = self.index.get(base) if base else None
+        if not exists:
+            record = ('F', content)
+            if self.deltas and base_sha1 and base_sha1 != sha1:
+                depth = self._get_depth(base_sha1)
+                if depth < self.max_chain:
+                    record = ('D', base_sha1, depth + 1, self._delta(self.get_blob(base_sha1), content))
+            self._write(sha1, zlib.compress(cPickle.dumps(record, cPickle.HIGHEST_PROTOCOL)))
+            with self.lock:
+                self.depth[sha1] = record[2] if record[0] == 'D' else 0
+        with self.lock:
+            if exists:
+                self.deduplicated += 1
+            else:
+                self.stored += 1
+            if not known:
+                self.index[objectname] = sha1
+                f = open(os.path.join(self.root, 'index'), 'ab')
+                f.write(objectname + '\t' + sha1 + '\n')
+                f.close()
+        return sha1
+
+    def _write(self, sha1, data):
+        path = self._path(sha1)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        # write aside and rename, so readers never see a partial blob
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        os.write(fd, data)
+        os.close(fd)
+        os.rename(tmp, path)
+        with self.lock:
+            self.bytes_written += len(data)
+
+    def _read(self, sha1):
+        f = open(self._path(sha1), 'rb')
+        record = cPickle.loads(zlib.decompress(f.read()))
+        f.close()
+        return record
+
+    def _get_depth(self, sha1):
+        with self.lock:
+            if sha1 in self.depth:
+                return self.depth[sha1]
+        record = self._read(sha1)
+        depth = record[2] if record[0] == 'D' else 0
+        with self.lock:
+            self.depth[sha1] = depth
+        return depth
+
+    def _delta(self, old, new):
+        """Operations rebuilding new from the lines of old: ('c', first, last) copies, ('i', text) inserts"""
+        old_lines = old.splitlines(True)
+        new_lines = new.splitlines(True)
+        ops = []
+        for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, old_lines, new_lines, False).get_opcodes():
+            if tag == 'equal':
+                ops.append(('c', i1, i2))
+            elif j2 > j1:
+                ops.append(('i', ''.join(new_lines[j1:j2])))
+        return ops
+
+    def get_blob(self, sha1):
+        """The content with this sha1"""
+        record = self._read(sha1)
+        if record[0] == 'F':
+            return record[1]
+        old_lines = self.get_blob(record[1]).splitlines(True)
+        content = []
+        for op in record[3]:
+            if op[0] == 'c':
+                content.extend(old_lines[op[1]:op[2]])
+            else:
+                content.append(op[1])
+        return ''.join(content)
+
+    def get(self, objectname):
+        """The content of the object version, or None if it is not stored"""
+        with self.lock:
+            sha1 = self.index.get(objectname)
+        if sha1 is None:
+            return None
+        return self.get_blob(sha1)
+
+    def statistics(self):
+        with self.lock:
+            return {'objects': len(self.index), 'stored': self.stored, 'deduplicated': self.deduplicated,
+                    'cat_skipped': self.skipped, 'bytes_written': self.bytes_written}
+
+    def __str__(self):
+        stats = self.statistics()
+        return "%d object versions, %d contents stored (%d bytes), %d duplicates, %d cat commands skipped" % (
+            stats['objects'], stats['stored'], stats['bytes_written'], stats['deduplicated'], stats['cat_skipped'])
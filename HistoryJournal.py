@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+HistoryJournal.py
+
+An append-only journal of the objects, tasks and releases done by a history fetch, to resume it after a crash
+
+Copyright (c) 2011 Nokia. All rights reserved.
+"""
+
+import os
+import zlib
+import struct
+import cPickle
+from threading import Lock
+
+class HistoryJournal(object):
+    """Records (kind, tag, name, value) as soon as they are done: ('objects', tag, None, {objectname: FileObject}),
+    ('task', tag, display name, TaskObject or None if the task is not used) and ('release', tag, None, None).
+
+    The objects found together, i.e. a changed object and the predecessors fetched for it, are one
+    record, so a crash never leaves an object journaled without the history found with it.
+
+    Every record is a 4 byte big endian length followed by a zlib compressed pickle, as in the
+    corpus of SynergyReplay. A record cut short by a crash is dropped when the journal is opened"""
+
+    def __init__(self, fname, resume=False):
+        self.fname = fname
+        self.lock = Lock()
+        self.num_of_records = 0
+        if not resume and os.path.isfile(self.fname):
+            os.remove(self.fname)
+        self.fh = open(self.fname, 'ab')
+        self.fh.truncate(self._valid_length())
+        self.fh.seek(0, os.SEEK_END)
+
+    def _records(self):
+        """Yield (offset after the record, record) for all complete records"""
+        if not os.path.isfile(self.fname):
+            return
+        f = open(self.fname, 'rb')
+        offset = 0
+        while True:
+            header = f.read(4)
+            if len(header) < 4:
+                break
+            length = struct.unpack('>I', header)[0]
+            data = f.read(length)
+            if len(data) < length:
+                break
+            try:
+                record = cPickle.loads(zlib.decompress(data))
+            except (zlib.error, cPickle.UnpicklingError, EOFError):
+                break
+            offset += 4 + length
+            yield offset, record
+        f.close()
+
+    def _valid_length(self):
+        length = 0
+        for length, record in self._records():
+            pass
+        return length
+
+    def _append(self, record):
+        data = zlib.compress(cPickle.dumps(record, cPickle.HIGHEST_PROTOCOL))
+        with self.lock:
+            self.fh.write(struct.pack('>I', len(data)) + data)
+            self.fh.flush()
+            self.num_of_records += 1
+
+    def add_objects(self, tag, fileobjects):
+        """Record {objectname: FileObject} of objects which are done together"""
+        self._append(('objects', tag, None, fileobjects))
+
+    def add_task(self, tag, name, taskobject):
+        """Record a task with its info filled out, or None for a task which is not used in the release"""
+        self._append(('task', tag, name, taskobject))
+
+    def release_done(self, tag):
+        self._append(('release', tag, None, None))
+
+    def replay(self):
+        """{tag: {'objects': {objectname: FileObject}, 'tasks': {display name: TaskObject or None}, 'done': bool}}"""
+        releases = {}
+        for offset, (kind, tag, name, value) in self._records():
+            release = releases.setdefault(tag, {'objects': {}, 'tasks': {}, 'done': False})
+            if kind == 'objects':
+                release['objects'].update(value)
+            elif kind == 'task':
+                release['tasks'][name] = value
+            elif kind == 'release':
+                release['done'] = True
+        return releases
+
+    def close(self, remove=False):
+        """Close the journal, removing it if the history it protects has been saved"""
+        with self.lock:
+            self.fh.close()
+            if remove:
+                os.remove(self.fname)
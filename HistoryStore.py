@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+HistoryStore.py
+
+The history of releases as individually encoded records in an append-only file with an index
+
+Copyright (c) 2011 Nokia. All rights reserved.
+"""
+
+import os
+import mmap
+import zlib
+import struct
+import cPickle
+from threading import Lock
+
+class HistoryStore(object):
+    """Records of the objects, tasks and metadata of releases in name.data, indexed in name.index.
+
+    Every record in the data file is a 4 byte big endian length followed by a zlib compressed
+    pickle of (kind, tag, name, value). A release is stored as a 'begin' record, its 'object'
+    records by objectname, its 'task' records by display name and finally a 'release' record with
+    the rest of its dict (name, previous, next, created, author). Storing a release again replaces
+    it, but its old records stay in the data file until compact() rewrites it. Every record appends
+    one line 'kind tag name offset length' to the index, so writing costs the same however much is
+    stored already. Records written after the last index line, i.e. by a run which died, are
+    indexed again when the store is opened"""
+
+    def __init__(self, name):
+        self.fname = name + '.data'
+        self.index_fname = name + '.index'
+        self.lock = Lock()
+        self._open()
+
+    def _open(self):
+        # tag -> {'begin': (offset, length), 'objects': {objectname: (offset, length)}, 'tasks': {...}, 'release': (offset, length) or None}
+        self.index = {}
+        # tags in the order their releases were completed
+        self.order = []
+        self.reader = None
+        end = self._load_index()
+        self.data = open(self.fname, 'ab')
+        self.index_file = open(self.index_fname, 'ab')
+        self._recover(end)
+
+    def _load_index(self):
+        """Read the index, returns the end of the last record it covers"""
+        end = 0
+        if not os.path.isfile(self.index_fname):
+            return end
+        size = os.path.getsize(self.fname) if os.path.isfile(self.fname) else 0
+        valid = 0
+        f = open(self.index_fname, 'rb')
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            # a line cut short, or one for data which never made it to disk, ends the index
+            if not line.endswith('\n') or len(fields) != 5 or int(fields[3]) + int(fields[4]) > size:
+                break
+            kind, tag, name, offset, length = fields
+            self._add(kind, tag, name, (int(offset), int(length)))
+            end = int(offset) + int(length)
+            valid += len(line)
+        f.close()
+        if valid < os.path.getsize(self.index_fname):
+            f = open(self.index_fname, 'r+b')
+            f.truncate(valid)
+            f.close()
+        return end
+
+    def _recover(self, end):
+        """Index the complete records after end and drop a record cut short"""
+        size = os.path.getsize(self.fname)
+        if end == size:
+            return
+        f = open(self.fname, 'rb')
+        f.seek(end)
+        while True:
+            header = f.read(4)
+            if len(header) < 4:
+                break
+            length = struct.unpack('>I', header)[0]
+            data = f.read(length)
+            if len(data) < length:
+                break
+            try:
+                kind, tag, name, value = cPickle.loads(zlib.decompress(data))
+            except (zlib.error, cPickle.UnpicklingError, EOFError):
+                break
+            self._index(kind, tag, name, end, 4 + length)
+            end += 4 + length
+        f.close()
+        self.data.truncate(end)
+        self.data.seek(0, os.SEEK_END)
+        self.index_file.flush()
+
+    def _add(self, kind, tag, name, location):
+        if kind == 'begin':
+            self.index[tag] = {'begin': location, 'objects': {}, 'tasks': {}, 'release': None}
+            if tag in self.order:
+                self.order.remove(tag)
+        elif kind == 'object':
+            self.index[tag]['objects'][name] = location
+        elif kind == 'task':
+            self.index[tag]['tasks'][name] = location
+        elif kind == 'release':
+            self.index[tag]['release'] = location
+            self.order.append(tag)
+
+    def _index(self, kind, tag, name, offset, length):
+        self._add(kind, tag, name, (offset, length))
+        self.index_file.write('\t'.join([kind, tag, name or '-', str(offset), str(length)]) + '\n')
+
+    def _append(self, kind, tag, name, value):
+        data = zlib.compress(cPickle.dumps((kind, tag, name, value), cPickle.HIGHEST_PROTOCOL))
+        with self.lock:
+            offset = self.data.tell()
+            self.data.write(struct.pack('>I', len(data)) + data)
+            self._index(kind, tag, name, offset, 4 + len(data))
+
+    def put_release(self, tag, release):
+        """Store a release dict as it is kept by CCMHistory: objects, tasks and the rest"""
+        self._append('begin', tag, None, None)
+        for o in release.get('objects', []):
+            self._append('object', tag, o.get_object_name(), o)
+        for t in release.get('tasks', []):
+            self._append('task', tag, t.get_display_name(), t)
+        self._append('release', tag, None, dict([(k, v) for k, v in release.iteritems() if k not in ['objects', 'tasks']]))
+        self.flush()
+
+    def import_history(self, history):
+        """Store all releases of a history dict, i.e. one loaded from an old pickle"""
+        for tag, release in history.iteritems():
+            self.put_release(tag, release)
+
+    def garbage(self):
+        """Bytes of the data file which do not belong to a stored release, i.e. of releases stored again"""
+        with self.lock:
+            self.data.flush()
+            live = 0
+            for tag in self.order:
+                entry = self.index[tag]
+                live += sum([l for o, l in entry['objects'].values() + entry['tasks'].values() + [entry['begin'], entry['release']]])
+            return os.path.getsize(self.fname) - live
+
+    def compact(self):
+        """Rewrite the data file with only the records of the stored releases.
+
+        The index is removed before the new data file replaces the old one, so a crash in between
+        leaves a data file which is indexed again when the store is opened"""
+        with self.lock:
+            self.data.close()
+            self.index_file.close()
+            if self.reader:
+                self.reader.close()
+            source = open(self.fname, 'rb')
+            data = open(self.fname + '.compact', 'wb')
+            index = open(self.index_fname + '.compact', 'wb')
+
+            def copy(kind, tag, name, location):
+                source.seek(location[0])
+                index.write('\t'.join([kind, tag, name or '-', str(data.tell()), str(location[1])]) + '\n')
+                data.write(source.read(location[1]))
+
+            for tag in self.order:
+                entry = self.index[tag]
+                copy('begin', tag, None, entry['begin'])
+                for name, location in sorted(entry['objects'].items(), key=lambda i: i[1]):
+                    copy('object', tag, name, location)
+                for name, location in sorted(entry['tasks'].items(), key=lambda i: i[1]):
+                    copy('task', tag, name, location)
+                copy('release', tag, None, entry['release'])
+            source.close()
+            data.close()
+            index.close()
+            os.remove(self.index_fname)
+            os.rename(self.fname + '.compact', self.fname)
+            os.rename(self.index_fname + '.compact', self.index_fname)
+            self._open()
+
+    def flush(self):
+        with self.lock:
+            self.data.flush()
+            self.index_file.flush()
+
+    def _read(self, location):
+        with self.lock:
+            self.data.flush()
+            if self.reader is None:
+                self.reader = open(self.fname, 'rb')
+            self.reader.seek(location[0] + 4)
+            data = self.reader.read(location[1] - 4)
+        return cPickle.loads(zlib.decompress(data))[3]
+
+    def releases(self):
+        """The tags of the stored releases"""
+        with self.lock:
+            return list(self.order)
+
+    def get_release(self, tag):
+        """The metadata of a release: name, previous, next, created and author"""
+        return self._read(self.index[tag]['release'])
+
+    def get_object(self, tag, objectname):
+        """The FileObject of the release, or None"""
+        location = self.index[tag]['objects'].get(objectname)
+        return self._read(location) if location else None
+
+    def get_task(self, tag, name):
+        """The TaskObject of the release by display name, or None"""
+        location = self.index[tag]['tasks'].get(name)
+        return self._read(location) if location else None
+
+    def iter_objects(self, tag):
+        """Stream the FileObjects of a release in the order they were stored"""
+        for location in sorted(self.index[tag]['objects'].values()):
+            yield self._read(location)
+
+    def iter_tasks(self, tag):
+        for location in sorted(self.index[tag]['tasks'].values()):
+            yield self._read(location)
+
+    def load_release(self, tag):
+        """The release dict with all its objects and tasks"""
+        release = self.get_release(tag)
+        release['objects'] = list(self.iter_objects(tag))
+        release['tasks'] = list(self.iter_tasks(tag))
+        return release
+
+    def load(self):
+        """The whole history, {tag: release dict}"""
+        return dict([(tag, self.load_release(tag)) for tag in self.releases()])
+
+    def close(self):
+        with self.lock:
+            self.data.close()
+            self.index_file.close()
+            if self.reader:
+                self.reader.close()
+
+
+class LazyRelease(dict):
+    """The metadata of a release, with its objects and tasks read from the store when they are used"""
+
+    def __init__(self, history, tag, metadata):
+        dict.__init__(self, metadata)
+        self.history = history
+        self.tag = tag
+
+    def __getitem__(self, key):
+        if key in ('objects', 'tasks'):
+            return self.history.materialize(self.tag)[key]
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        if key in ('objects', 'tasks'):
+            return self[key]
+        return dict.get(self, key, default)
+
+    def __contains__(self, key):
+        return key in ('objects', 'tasks') or dict.__contains__(self, key)
+
+
+class LazyHistory(object):
+    """A read-only history dict over a HistoryStore, for graphing and exporting one release at a time.
+
+    The index is memory mapped and only the range of index lines of every release is kept. The
+    objects and tasks of a release are read when they are first used, and the ones of all other
+    releases except its previous release are dropped then, so at most two adjacent releases are
+    in memory when the releases are walked from the initial one by 'next'"""
+
+    def __init__(self, name):
+        self.data = open(name + '.data', 'rb')
+        size = os.fstat(self.data.fileno()).st_size
+        f = open(name + '.index', 'rb')
+        self.index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else ''
+        f.close()
+        # tag -> (first, last) byte of its lines in the index
+        self.ranges = {}
+        self.releases = {}
+        # tag -> {'objects': [...], 'tasks': [...]} of the releases in memory
+        self.materialized = {}
+        begin = {}
+        position = 0
+        while True:
+            end = self.index.find('\n', position)
+            if end < 0:
+                break
+            kind, tag, name, offset, length = self.index[position:end].split('\t')
+            if int(offset) + int(length) > size:
+                break
+            if kind == 'begin':
+                begin[tag] = position
+            elif kind == 'release' and tag in begin:
+                self.ranges[tag] = (begin.pop(tag), end + 1)
+                self.releases[tag] = LazyRelease(self, tag, self._read(int(offset), int(length)))
+            position = end + 1
+
+    def _read(self, offset, length):
+        self.data.seek(offset + 4)
+        return cPickle.loads(zlib.decompress(self.data.read(length - 4)))[3]
+
+    def materialize(self, tag):
+        """The objects and tasks of a release, read from the store if they are not in memory"""
+        if tag in self.materialized:
+            return self.materialized[tag]
+        keep = [tag, self.releases[tag].get('previous')]
+        for t in self.materialized.keys():
+            if t not in keep:
+                del self.materialized[t]
+        locations = {'object': {}, 'task': {}}
+        first, last = self.ranges[tag]
+        for line in self.index[first:last].splitlines():
+            kind, t, name, offset, length = line.split('\t')
+            if kind in locations:
+                locations[kind][name] = (int(offset), int(length))
+        self.materialized[tag] = {'objects': [self._read(*l) for l in sorted(locations['object'].values())],
+                                  'tasks': [self._read(*l) for l in sorted(locations['task'].values())]}
+        return self.materialized[tag]
+
+    def __getitem__(self, tag):
+        return self.releases[tag]
+
+    def __contains__(self, tag):
+        return tag in self.releases
+
+    def __iter__(self):
+        return iter(self.releases)
+
+    def __len__(self):
+        return len(self.releases)
+
+    def keys(self):
+        return self.releases.keys()
+
+    def values(self):
+        return self.releases.values()
+
+    def iteritems(self):
+        return self.releases.iteritems()
+
+    def items(self):
+        return self.releases.items()
+
+    def close(self):
+        self.data.close()
+        if self.index:
+            self.index.close()
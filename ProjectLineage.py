@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+ProjectLineage.py
+
+The baseline relationships of released projects, to tell whether a project is some predecessor of a release
+
+Copyright (c) 2011 Nokia. All rights reserved.
+"""
+
+import os
+import cPickle
+from threading import Lock
+
+class ProjectLineage(object):
+    """Baselines of all released projects with the names of the subprojects of the releases being compared.
+
+    A project is some predecessor of the releases if a chain of released projects, each one
+    having the previous one as baseline, leads from it to a subproject of the current or old
+    release. The baselines of released projects never change, so they can be saved and loaded"""
+
+    def __init__(self):
+        self.lock = Lock()
+        # released project -> its baseline project, or None
+        self.baselines = {}
+        # project names whose released projects are all in baselines
+        self.names = set()
+        self.predecessors = set()
+
+    def load_names(self, ccm, names):
+        """Get the baselines of all released projects with these names, a few names per query"""
+        results = ccm.query_many(names, "name='{0}' and type='project' and status='released'", format=['%name', '%baseline'],
+                                 key_token=lambda name: name, row_token=lambda row: row['name'])
+        with self.lock:
+            for name, rows in results.iteritems():
+                for row in rows:
+                    baseline = row['baseline']
+                    self.baselines[row['objectname']] = baseline if baseline and baseline != '<void>' else None
+                self.names.add(name)
+
+    def prepare(self, ccm, targets):
+        """Index the lineage leading to targets, the subprojects of the current and old release.
+
+        A chain may pass through released projects of other names, so the names of the baselines
+        reached are loaded as well, until every chain ends in a project which is not released"""
+        # releases made since the lineage was saved need their names loaded again
+        names = set([ccm.object_family(t)[0] for t in targets if t not in self.baselines])
+        names.update([ccm.object_family(t)[0] for t in targets if ccm.object_family(t)[0] not in self.names])
+        if names:
+            self.load_names(ccm, sorted(names))
+        predecessors, names = self._walk(ccm, targets)
+        while names:
+            self.load_names(ccm, sorted(names))
+            predecessors, names = self._walk(ccm, targets)
+        with self.lock:
+            self.predecessors = predecessors
+
+    def _walk(self, ccm, targets):
+        """The projects on the chains leading to targets, and the names of projects reached whose baselines are not loaded"""
+        predecessors = set()
+        missing = set()
+        for target in targets:
+            if target not in self.baselines:
+                # not released, so it is no successor in a chain
+                continue
+            baseline = self.baselines[target]
+            while baseline and baseline not in predecessors:
+                predecessors.add(baseline)
+                if baseline not in self.baselines and ccm.object_family(baseline)[0] not in self.names:
+                    missing.add(ccm.object_family(baseline)[0])
+                # the chain continues only through released projects
+                baseline = self.baselines.get(baseline)
+        return predecessors, missing
+
+    def is_some_predecessor(self, ccm, project):
+        """True or False, or None if the lineage of the project's name is not indexed"""
+        with self.lock:
+            if ccm.object_family(project)[0] not in self.names:
+                return None
+            return project in self.predecessors
+
+    def save(self, fname):
+        with self.lock:
+            f = open(fname, 'wb')
+            cPickle.dump({'baselines': self.baselines, 'names': self.names}, f, cPickle.HIGHEST_PROTOCOL)
+            f.close()
+
+    @staticmethod
+    def load(fname):
+        """A lineage saved earlier, or an empty one if the file does not exist"""
+        lineage = ProjectLineage()
+        if os.path.isfile(fname):
+            f = open(fname, 'rb')
+            data = cPickle.load(f)
+            f.close()
+            lineage.baselines = data['baselines']
+            lineage.names = data['names']
+        return lineage
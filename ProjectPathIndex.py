@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+ProjectPathIndex.py
+
+The paths of all objects in a release, from one walk of its project and directory tree
+
+Copyright (c) 2011 Nokia. All rights reserved.
+"""
+
+from threading import Lock
+
+class ProjectPathIndex(object):
+    """Paths of the members of releases, so the path of an object needs no finduse.
+
+    The paths have the same form as the ones found with finduse: the name of the top-level
+    project followed by the directories, i.e. prod/lib/src/file.c. The index can be shared by
+    any number of sessions once the releases are built"""
+
+    row_format = ['%name', '%type']
+
+    def __init__(self):
+        self.lock = Lock()
+        # release -> {objectname: path}
+        self.paths = {}
+        self.num_of_cmds = 0
+
+    def build(self, ccm, release):
+        """Walk the project tree of release with one is_child_of query per directory and project"""
+        if self.has_release(release):
+            return
+        paths = {}
+        name = ccm.object_family(release)[0]
+        # (directory or project, project it belongs to, path)
+        todo = [(release, release, name)]
+        while todo:
+            parent, project, path = todo.pop()
+            ccm.query("is_child_of('{0}', '{1}')".format(parent, project))
+            for f in self.row_format:
+                ccm.format(f)
+            self.num_of_cmds += 1
+            for row in ccm.run():
+                child = row['objectname']
+                if child in paths:
+                    continue
+                paths[child] = path + '/' + row['name']
+                if row['type'] == 'project':
+                    # the members of a subproject are the children of the subproject itself
+                    todo.append((child, child, paths[child]))
+                elif row['type'] == 'dir':
+                    todo.append((child, project, paths[child]))
+        with self.lock:
+            self.paths[release] = paths
+
+    def has_release(self, release):
+        with self.lock:
+            return release in self.paths
+
+    def retain(self, releases):
+        """Drop the paths of all other releases"""
+        with self.lock:
+            for release in self.paths.keys():
+                if release not in releases:
+                    del self.paths[release]
+
+    def lookup(self, objectname, release):
+        """The path of the object in release, or None if the object or the release is not indexed"""
+        with self.lock:
+            paths = self.paths.get(release)
+        if paths is None:
+            return None
+        return paths.get(objectname)
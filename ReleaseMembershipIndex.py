@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+ReleaseMembershipIndex.py
+
+The subprojects of releases and the object versions released in them
+
+Copyright (c) 2011 Nokia. All rights reserved.
+"""
+
+from threading import Lock
+
+class ReleaseMembershipIndex(object):
+    """Per release the set of its subprojects (the release included) and the set of object
+    versions which are members of one of its released subprojects, so has_member queries
+    against the releases being compared are set lookups. Shared by any number of sessions"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.subprojects = {}
+        self.members = {}
+
+    def build(self, ccm, release):
+        """One query for the subprojects and one is_member_of query per released subproject.
+
+        The release itself counts as a released subproject only if its own status is released"""
+        if self.has_release(release):
+            return
+        subprojects = set([release])
+        released = []
+        if ccm.attr(release).option('-s').option('status').run().strip() == 'released':
+            released.append(release)
+        for s in ccm.query("recursive_is_member_of('{0}', 'none') and type='project'".format(release)).format('%status').run_iter():
+            subprojects.add(s['objectname'])
+            if s['status'] == 'released':
+                released.append(s['objectname'])
+        members = set()
+        for project in released:
+            for o in ccm.query("is_member_of('{0}')".format(project)).run_iter():
+                members.add(o['objectname'])
+        with self.lock:
+            self.subprojects[release] = subprojects
+            self.members[release] = members
+
+    def has_release(self, release):
+        with self.lock:
+            return release in self.members
+
+    def retain(self, releases):
+        """Drop the sets of all other releases"""
+        with self.lock:
+            for release in self.members.keys():
+                if release not in releases:
+                    del self.members[release]
+                    del self.subprojects[release]
+
+    def get_subprojects(self, release):
+        with self.lock:
+            return self.subprojects[release]
+
+    def is_member(self, objectname, release):
+        """True if the object version is released in one of the subprojects of release"""
+        with self.lock:
+            return objectname in self.members[release]
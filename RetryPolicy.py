@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+RetryPolicy.py
+
+Decide whether a failed Synergy command is worth retrying, based on what ccm wrote to stderr
+
+Copyright (c) 2011 Nokia. All rights reserved.
+"""
+
+import re
+import random
+from threading import Lock
+
+class RetryPolicy(object):
+    """Classifies ccm error messages and retries the transient ones with exponential backoff and jitter"""
+
+    # (class, pattern) pairs, the first matching pattern classifies the error
+    error_classes = [
+        ('engine_busy', re.compile(r'engine\s+(is\s+)?busy|server\s+(is\s+)?busy|too many (sessions|users|connections)|'
+                                   r'unable to connect|connection (refused|reset|timed out)|try again later', re.I)),
+        ('lock_timeout', re.compile(r'lock\s*timeout|could not (get|obtain|acquire)\s+(a\s+)?lock|is locked|deadlock|'
+                                    r'ISAM error -(107|113|143|144|154)|SQL error -(243|244|245|246|250|263)', re.I)),
+    ]
+    transient_classes = set(['engine_busy', 'lock_timeout'])
+
+    def __init__(self, max_retries=6, base_delay=0.1, max_delay=5.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lock = Lock()
+        # number of retries done per error class
+        self.retries = {}
+        # number of failures seen per error class, retried or not
+        self.failures = {}
+
+    def classify(self, stderr):
+        """Returns the error class of a ccm error message"""
+        for error_class, pattern in self.error_classes:
+            if pattern.search(stderr):
+                return error_class
+        return 'error'
+
+    def should_retry(self, error_class, attempt):
+        """attempt is the number of retries already done for the command"""
+        with self.lock:
+            self.failures[error_class] = self.failures.get(error_class, 0) + 1
+        if error_class not in self.transient_classes or attempt >= self.max_retries:
+            return False
+        with self.lock:
+            self.retries[error_class] = self.retries.get(error_class, 0) + 1
+        return True
+
+    def delay(self, attempt):
+        """Seconds to wait before the next retry: full jitter over an exponentially growing window"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def statistics(self):
+        with self.lock:
+            return {'retries': dict(self.retries), 'failures': dict(self.failures)}
+
+    def __str__(self):
+        stats = self.statistics()
+        return ', '.join(["%s: %d failures, %d retries" % (k, v, stats['retries'].get(k, 0)) for k, v in sorted(stats['failures'].items())])
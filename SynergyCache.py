@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+SynergyCache.py
+
+Keep the answers of ccm commands on disk, so reruns over the same releases do not ask Synergy again
+
+Copyright (c) 2011 Nokia. All rights reserved.
+"""
+
+import os
+import re
+import time
+import zlib
+import sqlite3
+import hashlib
+from threading import Lock
+
+class QueryCache(object):
+    """An sqlite3 file of ccm answers keyed by database and normalized command, shared by any number of sessions.
+
+    Every command is classified by the rules: 'never' cached, 'volatile' answers which change when
+    new versions, releases or statuses appear and expire after volatile_lifetime seconds, and
+    'immutable' answers about object versions which are kept until evicted. Only commands naming
+    objects or projects which are all known to be released or integrated are immutable, the
+    statuses are learned from the rows of commands formatted with %status.
+    The least recently used answers are evicted when the compressed answers exceed max_bytes"""
+
+    # (command type or None for all, pattern searched in the arguments or None for all, class)
+    # the first matching rule classifies a command, commands matching no rule are immutable if
+    # every object they name has one of the static statuses and volatile otherwise
+    rules = [
+        (None, re.compile(r"%today|time\("), 'never'),
+        ('start', None, 'never'),
+        ('stop', None, 'never'),
+        ('delim', None, 'never'),
+        ('query', re.compile(r"is_successor_of|has_member|has_baseline_project|has_task_in|status\s*!?=|%status|%release"), 'volatile'),
+        ('attr', re.compile(r"^-l|^-s (status|status_log|release|modify_time) "), 'volatile'),
+        ('task', re.compile(r"%status|%release"), 'volatile'),
+        ('finduse', None, 'volatile'),
+        ('hist', None, 'volatile'),
+    ]
+    static_statuses = ('released', 'integrate')
+    # objectnames and project names, i.e. foo.c~3:csrc:1 or proj~working:project:1
+    objectname = re.compile(r"[^\s'\"(),|:]+:[^\s'\"(),|:]+:[^\s'\"(),|:]+")
+
+    def __init__(self, fname, max_bytes=1024 * 1024 * 1024, volatile_lifetime=24 * 3600, max_entry_bytes=64 * 1024 * 1024):
+        self.fname = fname
+        self.max_bytes = max_bytes
+        self.volatile_lifetime = volatile_lifetime
+        # larger answers are not kept
+        self.max_entry_bytes = max_entry_bytes
+        self.lock = Lock()
+        self.db = sqlite3.connect(fname, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS answers (key TEXT PRIMARY KEY, stdout BLOB, size INTEGER, stored REAL, used REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS answers_used ON answers (used)')
+        # caches made before answers were marked immutable get all their answers expired
+        if 'immutable' not in [row[1] for row in self.db.execute('PRAGMA table_info(answers)')]:
+            self.db.execute('ALTER TABLE answers ADD COLUMN immutable INTEGER DEFAULT 0')
+        self.db.execute('CREATE TABLE IF NOT EXISTS statuses (objectname TEXT PRIMARY KEY)')
+        # objects known to be released or integrated
+        self.static = set([row[0] for row in self.db.execute('SELECT objectname FROM statuses')])
+        self.size = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM answers').fetchone()[0]
+        self.pending = 0
+        # per command type counters
+        self.hits = {}
+        self.misses = {}
+        self.uncacheable = {}
+        self.evictions = 0
+
+    def classify(self, command):
+        """'never', 'volatile' or 'immutable' for a command line including the ccm executable name"""
+        arguments = ' '.join(command[2:]) + ' '
+        for command_type, pattern, cache_class in self.rules:
+            if command_type and command_type != command[1]:
+                continue
+            if pattern is None or pattern.search(arguments):
+                return cache_class
+        names = self.objectname.findall(arguments)
+        with self.lock:
+            if names and all([name in self.static for name in names]):
+                return 'immutable'
+        return 'volatile'
+
+    def learn(self, rows):
+        """Remember the objects of formatted rows which have a static %status"""
+        for row in rows:
+            if row.get('status') in self.static_statuses and 'objectname' in row:
+                with self.lock:
+                    if row['objectname'] not in self.static:
+                        self.static.add(row['objectname'])
+                        self.db.execute('INSERT OR IGNORE INTO statuses VALUES (?)', (row['objectname'],))
+                        self._changed()
+
+    def cacheable(self, command):
+        return self.classify(command) != 'never'
+
+    def _normalize(self, argument):
+        # collapse white space outside of quoted strings
+        parts = re.split(r"('[^']*')", argument)
+        return ''.join([p if p.startswith("'") else re.sub(r'\s+', ' ', p) for p in parts]).strip()
+
+    def key(self, database, command):
+        return hashlib.sha1('\0'.join([database] + [self._normalize(a) for a in command[1:]])).hexdigest()
+
+    def _count(self, counter, command):
+        counter[command[1]] = counter.get(command[1], 0) + 1
+
+    def get(self, database, command):
+        """The cached stdout of the command, or None"""
+        cache_class = self.classify(command)
+        key = self.key(database, command)
+        with self.lock:
+            if cache_class == 'never':
+                self._count(self.uncacheable, command)
+                return None
+            row = self.db.execute('SELECT stdout, stored, immutable FROM answers WHERE key = ?', (key,)).fetchone()
+            # an answer stored before its objects were released expires like any volatile one
+            if row is None or (not row[2] and time.time() - row[1] > self.volatile_lifetime):
+                self._count(self.misses, command)
+                return None
+            self._count(self.hits, command)
+            self.db.execute('UPDATE answers SET used = ? WHERE key = ?', (time.time(), key))
+            self._changed()
+        return zlib.decompress(str(row[0]))
+
+    def put(self, database, command, stdout):
+        """Store the stdout of a successful command, if it is cacheable"""
+        cache_class = self.classify(command)
+        if cache_class == 'never' or len(stdout) > self.max_entry_bytes:
+            return
+        key = self.key(database, command)
+        data = zlib.compress(stdout)
+        now = time.time()
+        with self.lock:
+            old = self.db.execute('SELECT size FROM answers WHERE key = ?', (key,)).fetchone()
+            if old:
+                self.size -= old[0]
+            self.db.execute('INSERT OR REPLACE INTO answers (key, stdout, size, stored, used, immutable) VALUES (?, ?, ?, ?, ?, ?)',
+                            (key, sqlite3.Binary(data), len(data), now, now, int(cache_class == 'immutable')))
+            self.size += len(data)
+            if self.size > self.max_bytes:
+                self._evict()
+            self._changed()
+
+    def _evict(self):
+        # drop the least recently used answers until there is room for a while
+        target = self.max_bytes * 0.9
+        while self.size > target:
+            rows = self.db.execute('SELECT key, size FROM answers ORDER BY used LIMIT 100').fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self.size <= target:
+                    break
+                self.db.execute('DELETE FROM answers WHERE key = ?', (key,))
+                self.size -= size
+                self.evictions += 1
+
+    def _changed(self):
+        self.pending += 1
+        if self.pending >= 100:
+            self.db.commit()
+            self.pending = 0
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+    def statistics(self):
+        with self.lock:
+            return {'hits': dict(self.hits), 'misses': dict(self.misses), 'uncacheable': dict(self.uncacheable),
+                    'evictions': self.evictions, 'bytes': self.size}
+
+    def __str__(self):
+        stats = self.statistics()
+        lines = []
+        for command_type in sorted(set(stats['hits'].keys() + stats['misses'].keys())):
+            hits = stats['hits'].get(command_type, 0)
+            misses = stats['misses'].get(command_type, 0)
+            lines.append("%-8s %7d hits %7d misses %5.1f%% hit rate" % (command_type, hits, misses, 100.0 * hits / (hits + misses)))
+        lines.append("%d bytes cached, %d evictions" % (stats['bytes'], stats['evictions']))
+        return '\n'.join(lines)
+
+
+def cache_from_environment():
+    """A cache selected by CCM_CACHE=<file> (and CCM_CACHE_SIZE in megabytes), or None"""
+    if not os.environ.get('CCM_CACHE'):
+        return None
+    return QueryCache(os.environ['CCM_CACHE'], int(os.environ.get('CCM_CACHE_SIZE', '1024')) * 1024 * 1024)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+SynergyMetrics.py
+
+Count and time the ccm commands issued by Synergy sessions
+
+Copyright (c) 2011 Nokia. All rights reserved.
+"""
+
+import json
+from threading import Lock
+
+class MetricsRegistry(object):
+    """Per command type counters and latency histograms, shared by any number of sessions"""
+
+    # upper bounds in seconds of the latency histogram buckets
+    buckets = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+
+    def __init__(self):
+        self.lock = Lock()
+        self.commands = {}
+        self.sessions = {}
+
+    def _new_command(self):
+        return {'count': 0, 'cached': 0, 'failed': 0, 'retries': 0, 'bytes': 0, 'seconds': 0.0, 'histogram': [0] * (len(self.buckets) + 1)}
+
+    def record(self, session_id, command_type, seconds, retries=0, nbytes=0, failed=False, cached=False):
+        """Record one command, i.e. record(0, 'query', 0.12, 0, 2048).
+
+        A command answered by the cache is only counted as cached, count is the commands ccm ran"""
+        bucket = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                bucket = i
+                break
+        with self.lock:
+            if command_type not in self.commands:
+                self.commands[command_type] = self._new_command()
+            c = self.commands[command_type]
+            if cached:
+                c['cached'] += 1
+                return
+            c['count'] += 1
+            c['retries'] += retries
+            c['bytes'] += nbytes
+            c['seconds'] += seconds
+            c['histogram'][bucket] += 1
+            if failed:
+                c['failed'] += 1
+            self.sessions[session_id] = self.sessions.get(session_id, 0) + 1
+
+    def merge(self, other):
+        """Add the numbers of another registry to this one"""
+        snapshot = other.snapshot()
+        with self.lock:
+            for command_type, o in snapshot['commands'].iteritems():
+                if command_type not in self.commands:
+                    self.commands[command_type] = self._new_command()
+                c = self.commands[command_type]
+                for k in ['count', 'cached', 'failed', 'retries', 'bytes', 'seconds']:
+                    c[k] += o.get(k, 0)
+                c['histogram'] = [a + b for a, b in zip(c['histogram'], o['histogram'])]
+            for session_id, count in snapshot['sessions'].iteritems():
+                self.sessions[session_id] = self.sessions.get(session_id, 0) + count
+
+    def snapshot(self):
+        """A consistent copy of the numbers"""
+        with self.lock:
+            commands = {}
+            for command_type, c in self.commands.iteritems():
+                commands[command_type] = dict(c)
+                commands[command_type]['histogram'] = list(c['histogram'])
+            return {'commands': commands, 'sessions': dict(self.sessions)}
+
+    def to_json(self):
+        snapshot = self.snapshot()
+        snapshot['buckets'] = self.buckets
+        # json keys must be strings
+        snapshot['sessions'] = dict([(str(k), v) for k, v in snapshot['sessions'].iteritems()])
+        return json.dumps(snapshot, indent=2, sort_keys=True)
+
+    def to_prometheus(self):
+        """The numbers in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = []
+        lines.append('# TYPE ccm_commands_total counter')
+        for command_type, c in sorted(snapshot['commands'].items()):
+            lines.append('ccm_commands_total{type="%s"} %d' % (command_type, c['count']))
+        lines.append('# TYPE ccm_command_cache_hits_total counter')
+        for command_type, c in sorted(snapshot['commands'].items()):
+            lines.append('ccm_command_cache_hits_total{type="%s"} %d' % (command_type, c['cached']))
+        lines.append('# TYPE ccm_command_failures_total counter')
+        for command_type, c in sorted(snapshot['commands'].items()):
+            lines.append('ccm_command_failures_total{type="%s"} %d' % (command_type, c['failed']))
+        lines.append('# TYPE ccm_command_retries_total counter')
+        for command_type, c in sorted(snapshot['commands'].items()):
+            lines.append('ccm_command_retries_total{type="%s"} %d' % (command_type, c['retries']))
+        lines.append('# TYPE ccm_command_bytes_total counter')
+        for command_type, c in sorted(snapshot['commands'].items()):
+            lines.append('ccm_command_bytes_total{type="%s"} %d' % (command_type, c['bytes']))
+        lines.append('# TYPE ccm_command_seconds histogram')
+        for command_type, c in sorted(snapshot['commands'].items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, c['histogram']):
+                cumulative += n
+                lines.append('ccm_command_seconds_bucket{type="%s",le="%s"} %d' % (command_type, bound, cumulative))
+            lines.append('ccm_command_seconds_bucket{type="%s",le="+Inf"} %d' % (command_type, c['count']))
+            lines.append('ccm_command_seconds_sum{type="%s"} %f' % (command_type, c['seconds']))
+            lines.append('ccm_command_seconds_count{type="%s"} %d' % (command_type, c['count']))
+        lines.append('# TYPE ccm_session_commands_total counter')
+        for session_id, count in sorted(snapshot['sessions'].items()):
+            lines.append('ccm_session_commands_total{session="%s"} %d' % (session_id, count))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, fname, format='json'):
+        """Write the numbers to a file, as 'json' or 'prometheus'"""
+        if format == 'prometheus':
+            data = self.to_prometheus()
+        else:
+            data = self.to_json()
+        f = open(fname, 'w')
+        f.write(data)
+        f.close()
+
+    def __str__(self):
+        snapshot = self.snapshot()
+        lines = []
+        for command_type, c in sorted(snapshot['commands'].items()):
+            lines.append("%-8s %7d commands %7d cached %6d retries %6d failed %10.1f s %12d bytes" % (command_type, c['count'], c['cached'], c['retries'], c['failed'], c['seconds'], c['bytes']))
+        return '\n'.join(lines)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+SynergyReplay.py
+
+Record the ccm commands of Synergy sessions and their answers to a corpus on disk, and serve
+them again without a Synergy database. Use RecordingBackend or ReplayBackend as the backend of
+a SynergySession, or point command_name at fake_ccm.py to replay from a separate process.
+
+Copyright (c) 2011 Nokia. All rights reserved.
+"""
+
+import os
+import time
+import zlib
+import struct
+import cPickle
+from threading import Lock
+from subprocess import Popen, PIPE
+
+def command_key(command):
+    """The key of a command line in the corpus: the command without the name of the ccm executable"""
+    return tuple(command[1:])
+
+
+class Corpus(object):
+    """An append-only file of compressed (command, stdout, stderr) records.
+
+    Every record is a 4 byte big endian length followed by a zlib compressed pickle"""
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.lock = Lock()
+        self.answers = None
+
+    def append(self, key, stdout, stderr):
+        data = zlib.compress(cPickle.dumps((key, stdout, stderr), cPickle.HIGHEST_PROTOCOL))
+        with self.lock:
+            f = open(self.fname, 'ab')
+            f.write(struct.pack('>I', len(data)))
+            f.write(data)
+            f.close()
+            if self.answers is not None:
+                self.answers[key] = (stdout, stderr)
+
+    def records(self):
+        """Yield all (key, stdout, stderr) records in the order they were recorded"""
+        if not os.path.isfile(self.fname):
+            return
+        f = open(self.fname, 'rb')
+        while True:
+            header = f.read(4)
+            if len(header) < 4:
+                break
+            length = struct.unpack('>I', header)[0]
+            yield cPickle.loads(zlib.decompress(f.read(length)))
+        f.close()
+
+    def load(self):
+        """Read the whole corpus; the last answer recorded for a command wins"""
+        with self.lock:
+            if self.answers is None:
+                self.answers = {}
+                for key, stdout, stderr in self.records():
+                    self.answers[key] = (stdout, stderr)
+            return self.answers
+
+    def lookup(self, command):
+        """Returns (stdout, stderr) recorded for the command, or None"""
+        return self.load().get(command_key(command))
+
+
+class RecordingBackend(object):
+    """Runs the ccm commands and appends every answer to the corpus"""
+
+    def __init__(self, corpus):
+        self.corpus = corpus
+
+    def execute(self, command, environment):
+        p = Popen(command, stdout=PIPE, stderr=PIPE, env=environment)
+        stdout, stderr = p.communicate()
+        self.corpus.append(command_key(command), stdout, stderr)
+        return stdout, stderr
+
+
+class ReplayBackend(object):
+    """Answers the ccm commands from the corpus, after an optional artificial latency in seconds"""
+
+    def __init__(self, corpus, latency=0.0):
+        self.corpus = corpus
+        self.latency = latency
+        self.corpus.load()
+
+    def execute(self, command, environment):
+        if self.latency:
+            time.sleep(self.latency)
+        answer = self.corpus.lookup(command)
+        if answer is None:
+            return '', 'No recorded answer for the Synergy command: %s\n' % (command,)
+        return answer
+
+
+def backend_from_environment():
+    """A backend selected by CCM_RECORD=<corpus> or CCM_REPLAY=<corpus> (and CCM_REPLAY_LATENCY), or None"""
+    if os.environ.get('CCM_REPLAY'):
+        return ReplayBackend(Corpus(os.environ['CCM_REPLAY']), float(os.environ.get('CCM_REPLAY_LATENCY', '0')))
+    if os.environ.get('CCM_RECORD'):
+        return RecordingBackend(Corpus(os.environ['CCM_RECORD']))
+    return None
@@ -17,21 +17,38 @@ THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
 import os
 import re
 import time
-import random
+import select
+import uuid
+import tempfile
+from pipes import quote
 from threading import Thread
 from Queue import Queue
 from subprocess import Popen, PIPE
+from RetryPolicy import RetryPolicy
+from SynergyMetrics import MetricsRegistry
 
 class SynergySession(object):
     """This class is a wrapper around the Synergy command line client"""
 
-    def __init__(self, database, engine=None, command_name='ccm', ccm_ui_path='/dev/null', ccm_eng_path='/dev/null'):
+    # Upper bound for the length of a combined query string built by query_many()
+    query_max_length = 8000
+    # Largest answer run_iter() keeps in memory to store in the cache
+    stream_cache_bytes = 1024 * 1024
+
+    def __init__(self, database, engine=None, command_name='ccm', ccm_ui_path='/dev/null', ccm_eng_path='/dev/null', interactive=False, retry_policy=None, metrics=None, backend=None, cache=None):
         self.command_name = command_name
         self.database = database
         self.engine = engine
         self.num_of_cmds = 0
         self.sessionID = -1 # set to -1 for singular sessions; for multiple sessions populate from zero and up after creating the individual sessions
         self.q = Queue()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.metrics = metrics or MetricsRegistry()
+        # Optional object with an execute(command, environment) method replacing the ccm processes, see SynergyReplay
+        self.backend = backend
+        # Optional SynergyCache.QueryCache answering repeated commands from disk
+        self.cache = cache
+        self.shell = None
 
         # This dictionary will contain the status of the next command and will be emptied by self.run()
         self.command = ''
@@ -59,18 +76,18 @@ class SynergySession(object):
         self.environment['CCM_UILOG'] = ccm_ui_path
         self.environment['CCM_ENGLOG'] = ccm_eng_path
 
-        # Open the session
-        p = Popen(args, stdout=PIPE, stderr=PIPE, env=self.environment)
-        self.num_of_cmds += 1
-        # Store the session data
-        #p.wait()
-        stdout, stderr = p.communicate()
+        # Open the session and store the session data
+        stdout, stderr = self._execute(args)
         if stderr:
             raise SynergyException('Error while starting a synergy Session: ' + stderr)
 
         # Set the environment variable for the Synergy session
         self.environment['CCM_ADDR'] = stdout
 
+        # Optionally keep one ccm command interpreter open for the whole session
+        if interactive:
+            self.start_shell()
+
         # Get the delimiter and store it
         self.delimiter = self.delim()
 
@@ -87,6 +104,8 @@ class SynergySession(object):
         # Close the session
         self.stop()
         print "[" + str(self.sessionID) + "] Number of commands issued:", str(self.num_of_cmds)
+        if self.retry_policy.failures:
+            print "[" + str(self.sessionID) + "] Failed commands:", str(self.retry_policy)
 
     def _reset_status(self):
         """Reset the status of the object"""
@@ -99,30 +118,67 @@ class SynergySession(object):
         """Execute a Synergy command"""
         if not command[0] == self.command_name:
             command.insert(0, self.command_name)
-        
-        # retry all commands 3 times to patch over ccm concurrency issues
-        for retrycount in range(3):
-            # stagger parallel commands to patch over ccm concurrency issues
-            if (self.sessionID >= 0):
-                time.sleep(0.2 * random.random())
-
-            if (retrycount > 0): # more sleep on retry operations
-                time.sleep(0.2 * random.random())
 
-            p = Popen(command, stdout=PIPE, stderr=PIPE, env=self.environment)
-            self.num_of_cmds += 1
+        start = time.time()
+        if self.cache:
+            stdout = self.cache.get(self.database, command)
+            if stdout is not None:
+                self.metrics.record(self.sessionID, command[1], time.time() - start, 0, len(stdout), cached=True)
+                return stdout
 
+        # retry the commands failing because of ccm concurrency issues
+        attempt = 0
+        while True:
             # Store the result as a single string. It will be splitted later
-            stdout, stderr = p.communicate()
-            
-            if not stderr:
+            stdout, stderr = self._execute(command)
+
+            if not stderr or not self.retry_policy.should_retry(self.retry_policy.classify(stderr), attempt):
                 break
+            time.sleep(self.retry_policy.delay(attempt))
+            attempt += 1
 
+        self.metrics.record(self.sessionID, command[1], time.time() - start, attempt, len(stdout), bool(stderr))
         if stderr:
             raise SynergyException('Error while running the Synergy command: %s \nError message: %s' % (command, stderr))
 
+        if self.cache:
+            self.cache.put(self.database, command, stdout)
         return stdout
 
+    def _execute(self, command):
+        """Execute a single command, through the backend or the interactive shell if any, and return (stdout, stderr)"""
+        self.num_of_cmds += 1
+        if self.backend:
+            return self.backend.execute(command, self.environment)
+        if self.shell:
+            try:
+                return self.shell.execute(command[1:])
+            except SynergyShellException, e:
+                print "[" + str(self.sessionID) + "] Interactive ccm shell failed, falling back to one process per command:", e
+                self.stop_shell()
+
+        p = Popen(command, stdout=PIPE, stderr=PIPE, env=self.environment)
+        return p.communicate()
+
+    def start_shell(self):
+        """Open an interactive ccm command interpreter for this session.
+
+        Returns True if the shell is running, False if the session uses one process per command"""
+        if self.backend:
+            return False
+        try:
+            self.shell = SynergyShell(self.command_name, self.environment)
+        except (OSError, SynergyShellException), e:
+            print "[" + str(self.sessionID) + "] Interactive ccm shell unavailable, using one process per command:", e
+            self.shell = None
+        return self.shell is not None
+
+    def stop_shell(self):
+        """Close the interactive ccm command interpreter, if any"""
+        if self.shell:
+            self.shell.close()
+            self.shell = None
+
     def delim(self):
         """Returns the delimiter defined in the Synergy DB"""
         self._reset_status()
@@ -130,6 +186,7 @@ class SynergySession(object):
 
     def stop(self):
         """Stops the current Synergy session"""
+        self.stop_shell()
         if 'CCM_ADDR' in self.environment:
             self._run(['stop'])
 
@@ -142,6 +199,88 @@ class SynergySession(object):
             self.status['format'] = ['%objectname']
         return self
 
+    def query_many(self, keys, template, format=(), key_token=None, row_token=None, strip=True):
+        """Run the query template once per key, combining as many keys as possible in each ccm query.
+
+        template is a query string with a {0} placeholder for the key, i.e. "is_predecessor_of('{0}')",
+        or a function returning the query string for a key.
+        key_token(key) and row_token(row) must map a key and a resulting row to the same value, so
+        the rows of a combined query can be handed back to the key they belong to. Keys sharing a
+        token are never combined. Without key_token every key is queried on its own.
+        With strip=False the values are kept as ccm writes them, see keep_whitespace().
+
+        Returns a dictionary with the list of rows for every key"""
+        template, row_token = self._query_many_tokens(template, key_token, row_token)
+        results = {}
+        for key in keys:
+            results[key] = []
+
+        for chunk in self._query_chunks(results.keys(), template, key_token):
+            rows = self._chunk_query(chunk, template, format, strip).run()
+            self._demultiplex(results, chunk, rows, key_token, row_token)
+        return results
+
+    def _query_many_tokens(self, template, key_token, row_token):
+        """The template as a function and the row_token to use for query_many"""
+        if key_token and not row_token:
+            # by default the rows are demultiplexed by their objectname, which query() always formats
+            row_token = lambda row: key_token(row['objectname'])
+        if not callable(template):
+            template = template.format
+        return template, row_token
+
+    def _chunk_query(self, chunk, template, format, strip=True):
+        """Build the combined query of a chunk of keys, ready to run"""
+        self.query(' or '.join(['(' + template(key) + ')' for key in chunk]))
+        for f in format:
+            self.format(f)
+        if not strip:
+            self.keep_whitespace()
+        return self
+
+    def _demultiplex(self, results, chunk, rows, key_token, row_token):
+        """Hand the rows of a combined query to the keys of the chunk they belong to"""
+        if not key_token:
+            results[chunk[0]] = rows
+            return
+        lookup = dict([(key_token(key), key) for key in chunk])
+        for row in rows:
+            token = row_token(row)
+            if token in lookup:
+                results[lookup[token]].append(row)
+
+    def _query_chunks(self, keys, template, key_token):
+        """Split the keys in groups whose combined query fits in query_max_length"""
+        if not key_token:
+            return [[key] for key in keys]
+
+        chunks = []
+        pending = list(keys)
+        while pending:
+            chunk = []
+            tokens = set()
+            length = 0
+            postponed = []
+            for key in pending:
+                token = key_token(key)
+                size = len(template(key)) + 6
+                if token in tokens or (chunk and length + size > self.query_max_length):
+                    postponed.append(key)
+                    continue
+                chunk.append(key)
+                tokens.add(token)
+                length += size
+            chunks.append(chunk)
+            pending = postponed
+        return chunks
+
+    def object_family(self, objectname):
+        """Returns (name, type, instance) of a four part name, which is shared by all versions of an object"""
+        m = re.match('(.+)' + re.escape(self.delimiter) + '(.+):(.+):(.+)', objectname)
+        if not m:
+            raise SynergyException('The provided description ' + objectname + ' is not an objectname')
+        return m.group(1), m.group(3), m.group(4)
+
     def cat(self, object_name):
         """Cat an object"""
         self.command = 'cat'
@@ -202,9 +341,11 @@ class SynergySession(object):
         return self
 
     def hist(self, obj):
-        """history command"""
+        """history command, for one object or a list of objects"""
         self.command = 'hist'
-        self.status['arguments'] = [obj]
+        if isinstance(obj, str):
+            obj = [obj]
+        self.status['arguments'] = list(obj)
         self.status['options'] = []
         self.status['formattable'] = True
         if 'format' not in self.status:
@@ -233,6 +374,12 @@ class SynergySession(object):
 
         return self
 
+    def keep_whitespace(self):
+        """Keep the values of a formatted command as ccm writes them instead of stripping them,
+        i.e. multi-line attributes with their indentation and blank lines"""
+        self.status['strip'] = False
+        return self
+
     def option(self, option):
         """Sets the options for the command, if it supports options.
 
@@ -276,6 +423,21 @@ class SynergySession(object):
 
         At this point the command must be already set by i.e. query()
         """
+        command = self._build_command()
+        status = self.status
+        # Clean up
+        self._reset_status()
+
+        result = self._run(command)
+        # Parse the result and return it
+        result = self._parse_result(command, status, result)
+        if self.cache and isinstance(result, list):
+            # statuses of the objects tell the cache which answers are immutable
+            self.cache.learn(result)
+        return result
+
+    def _build_command(self):
+        """Build the command line from the status set by i.e. query()"""
         if not self.status:
             self.errors.append('before run() the status of the command must be already set')
 
@@ -304,51 +466,269 @@ class SynergySession(object):
                 command.append(element)
 
         command.extend(self.status['arguments'])
+        return command
 
-        result = self._run(command)
-        # Parse the result and return it
-        if 'formattable' in self.status and self.status['formattable']:
-            if not result:
-                # Clean up
-                self._reset_status()
-                return []
-
-            final_result = []
-            items = []
-            if 'hist' in command:
-                items = result.split('*****************************************************************************')[
-                        :-1]
-            else:
-                items = result.split('|ITEM_SEPARATOR|')[:-1]
-
-            for item in items:
-                splitted_item = item.split('|SEPARATOR|')
-                if len(splitted_item) != len(self.status['format']):
-                    raise SynergyException("the length of status['format'] and the splitted result is not the same")
-                line = {}
-                for k, v in zip(self.status['format'], splitted_item):
-                    line[k[1:]] = v.strip()
-                if 'hist' in command:
-                    # History command is special ;)
-                    p = re.compile("(?s)(.*?)Predecessors:\s*(.*)Successors:\s*(.*?)$")
-                    m = p.match(splitted_item[len(splitted_item) - 1])
-                    if m:
-                        line[self.status['format'][-1]] = m.group(1).split()
-                        line['predecessors'] = m.group(2).split()
-                        line['successors'] = m.group(3).split()
-                    else:
-                        line['predecessors'] = []
-                        line['successors'] = []
-
-                final_result.append(line)
-                # Clean up
-            self._reset_status()
-            return final_result
-        else:
-            # Clean up
-            self._reset_status()
+    def _parse_result(self, command, status, result):
+        """Split the output of a formatted command into a list of dictionaries, one per item"""
+        if not ('formattable' in status and status['formattable']):
             return result
 
+        if not result:
+            return []
+
+        final_result = []
+        for item in result.split(self._item_separator(command))[:-1]:
+            final_result.append(self._parse_item(command, status, item))
+        return final_result
+
+    def _item_separator(self, command):
+        if 'hist' in command:
+            return '*****************************************************************************'
+        return '|ITEM_SEPARATOR|'
+
+    def _parse_item(self, command, status, item):
+        """Parse one item of formatted output into a dictionary"""
+        splitted_item = item.split('|SEPARATOR|')
+        if len(splitted_item) != len(status['format']):
+            raise SynergyException("the length of status['format'] and the splitted result is not the same")
+        line = {}
+        if not status.get('strip', True):
+            # only the line break ccm writes after the separator of the previous item is not part of the values
+            if splitted_item[0].startswith('\n'):
+                splitted_item[0] = splitted_item[0][1:]
+            for k, v in zip(status['format'], splitted_item):
+                line[k[1:]] = v
+            return line
+        for k, v in zip(status['format'], splitted_item):
+            line[k[1:]] = v.strip()
+        if 'hist' in command:
+            # History command is special ;)
+            p = re.compile("(?s)(.*?)Predecessors:\s*(.*)Successors:\s*(.*?)$")
+            m = p.match(splitted_item[len(splitted_item) - 1])
+            if m:
+                line[status['format'][-1][1:]] = m.group(1).strip()
+                line['predecessors'] = m.group(2).split()
+                line['successors'] = m.group(3).split()
+            else:
+                line['predecessors'] = []
+                line['successors'] = []
+        return line
+
+    def run_iter(self):
+        """
+        Run a formattable Synergy command and yield the parsed items one by one as ccm outputs them.
+
+        The output is read in chunks and never held as a whole, so memory use does not depend on
+        the size of the result. The command always runs in its own process. It is retried only if
+        it fails before the first item arrived; a later failure raises after the items seen so far.
+        With a backend or a cached answer the whole result is parsed at once. Only answers up to
+        stream_cache_bytes are kept for the cache while streaming, so larger ones are not cached.
+        The process is killed if the items are not consumed to the end.
+        """
+        command = self._build_command()
+        status = self.status
+        self._reset_status()
+        if not ('formattable' in status and status['formattable']):
+            raise SynergyException("run_iter() needs a formattable command")
+        if self.backend:
+            for item in self._parse_result(command, status, self._run(command)):
+                if self.cache:
+                    self.cache.learn([item])
+                yield item
+            return
+        if self.cache:
+            start = time.time()
+            cached = self.cache.get(self.database, command)
+            if cached is not None:
+                self.metrics.record(self.sessionID, command[1], time.time() - start, 0, len(cached), cached=True)
+                for item in self._parse_result(command, status, cached):
+                    self.cache.learn([item])
+                    yield item
+                return
+        separator = self._item_separator(command)
+
+        start = time.time()
+        nbytes = 0
+        attempt = 0
+        while True:
+            stderr_file = tempfile.TemporaryFile()
+            p = None
+            try:
+                p = Popen(command, stdout=PIPE, stderr=stderr_file, env=self.environment)
+                self.num_of_cmds += 1
+                items_seen = 0
+                pending = []
+                tail = ''
+                kept = [] if self.cache and self.cache.cacheable(command) else None
+                kept_bytes = 0
+                while True:
+                    data = os.read(p.stdout.fileno(), 65536)
+                    if not data:
+                        break
+                    nbytes += len(data)
+                    if kept is not None:
+                        kept_bytes += len(data)
+                        kept.append(data)
+                        if kept_bytes > min(self.stream_cache_bytes, self.cache.max_entry_bytes):
+                            kept = None
+                    # only the new data and the end of the pending output can contain a new separator
+                    if separator not in tail + data:
+                        pending.append(data)
+                        tail = (tail + data)[-len(separator):]
+                        continue
+                    items = (''.join(pending) + data).split(separator)
+                    pending = [items.pop()]
+                    tail = pending[0][-len(separator):]
+                    for item in items:
+                        items_seen += 1
+                        item = self._parse_item(command, status, item)
+                        if self.cache:
+                            self.cache.learn([item])
+                        yield item
+                p.stdout.close()
+                p.wait()
+                stderr_file.seek(0)
+                stderr = stderr_file.read()
+            finally:
+                # the consumer may stop early or fail, the process and files must not outlive it
+                if p:
+                    if p.poll() is None:
+                        p.kill()
+                        p.wait()
+                    p.stdout.close()
+                stderr_file.close()
+
+            if not stderr:
+                self.metrics.record(self.sessionID, command[1], time.time() - start, attempt, nbytes)
+                if kept is not None:
+                    self.cache.put(self.database, command, ''.join(kept))
+                return
+            if items_seen or not self.retry_policy.should_retry(self.retry_policy.classify(stderr), attempt):
+                self.metrics.record(self.sessionID, command[1], time.time() - start, attempt, nbytes, True)
+                raise SynergyException('Error while running the Synergy command: %s \nError message: %s' % (command, stderr))
+            time.sleep(self.retry_policy.delay(attempt))
+            attempt += 1
+
+
+def query_literal(value):
+    """value as a string literal of the ccm query language, in double quotes if it contains a single quote"""
+    if "'" not in value:
+        return "'" + value + "'"
+    if '"' not in value:
+        return '"' + value + '"'
+    raise SynergyException('%s cannot be quoted in a ccm query' % value)
+
+
+class SynergyShell(object):
+    """A long lived ccm command interpreter which reads commands from stdin.
+
+    The output of every command is framed by echoing a unique sentinel after it. Its error
+    output is framed by running a command named after a second sentinel: ccm does not know it
+    and names it in the error it writes to stderr. Both pipes are read until both sentinels
+    arrived, so late error text is never missed or given to the next command. An interpreter
+    which does not report unknown commands on stderr fails the first command, and the session
+    falls back to one process per command"""
+
+    prompt = 'ccm> '
+    sentinel_command = 'echo %s'
+    # seconds to wait for output from a command before the interpreter is given up as hung
+    command_timeout = 600
+    # seconds to wait for the interpreter to exit before it is killed
+    close_timeout = 5
+
+    def __init__(self, command_name, environment, timeout=30):
+        self.sentinel = '__PYSYNERGY_' + uuid.uuid4().hex + '__'
+        self.error_sentinel = '__PYSYNERGY_ERROR_' + uuid.uuid4().hex + '__'
+        self.p = Popen([command_name], stdin=PIPE, stdout=PIPE, stderr=PIPE, env=environment)
+
+        # Make sure the interpreter answers before using it
+        try:
+            self.execute(None, timeout)
+        except SynergyShellException:
+            self.close()
+            raise
+
+    def _read_until_sentinels(self, timeout):
+        """Read stdout up to its sentinel and stderr up to the line naming the error sentinel"""
+        stdout_fd = self.p.stdout.fileno()
+        stderr_fd = self.p.stderr.fileno()
+        marker = self.sentinel + '\n'
+        output = {stdout_fd: '', stderr_fd: ''}
+        framed = {}
+        while len(framed) < 2:
+            waiting = [fd for fd in output if fd not in framed]
+            ready = select.select(waiting, [], [], timeout)[0]
+            if not ready:
+                raise SynergyShellException('no answer from the ccm shell within %s seconds' % timeout)
+            for fd in ready:
+                data = os.read(fd, 65536)
+                if not data:
+                    raise SynergyShellException('the ccm shell exited with code %s' % self.p.poll())
+                # only the new data and the length of a sentinel before it have to be searched
+                start = max(0, len(output[fd]) - len(marker))
+                output[fd] += data
+                if fd == stdout_fd:
+                    position = output[fd].find(marker, start)
+                    if position >= 0:
+                        framed[fd] = output[fd][:position]
+                else:
+                    position = output[fd].find(self.error_sentinel, start)
+                    if position >= 0 and '\n' in output[fd][position:]:
+                        # the error about the sentinel command is not part of the output
+                        framed[fd] = output[fd][:output[fd].rfind('\n', 0, position) + 1]
+        return framed[stdout_fd], framed[stderr_fd]
+
+    def _strip_prompts(self, output):
+        while output.startswith(self.prompt):
+            output = output[len(self.prompt):]
+        while output.endswith(self.prompt):
+            output = output[:-len(self.prompt)]
+        return output
+
+    def execute(self, args, timeout=None):
+        """Run one ccm command (without the leading command name) and return (stdout, stderr)"""
+        if timeout is None:
+            timeout = self.command_timeout
+        if self.p.poll() is not None:
+            raise SynergyShellException('the ccm shell is not running')
+        lines = []
+        if args:
+            lines.append(' '.join([quote(a) for a in args]))
+        lines.append(self.error_sentinel)
+        lines.append(self.sentinel_command % self.sentinel)
+        try:
+            self.p.stdin.write('\n'.join(lines) + '\n')
+            self.p.stdin.flush()
+        except IOError, e:
+            raise SynergyShellException('could not write to the ccm shell: %s' % e)
+
+        stdout, stderr = self._read_until_sentinels(timeout)
+        return self._strip_prompts(stdout), stderr
+
+    def close(self):
+        """Leave the interpreter, killing it if it does not exit"""
+        if self.p.poll() is None:
+            try:
+                self.p.stdin.write('exit\n')
+                self.p.stdin.close()
+            except IOError:
+                pass
+            deadline = time.time() + self.close_timeout
+            while self.p.poll() is None and time.time() < deadline:
+                time.sleep(0.05)
+            if self.p.poll() is None:
+                self.p.kill()
+            self.p.wait()
+
+
+class SynergyShellException(Exception):
+    """Raised when the interactive ccm shell cannot be used"""
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return repr(self.value)
+
 
 class SynergyException(Exception):
     """User defined exception raised by SynergySession"""
@@ -25,7 +25,11 @@ import random
 from datetime import datetime, timedelta
 from subprocess import Popen, PIPE
 import SynergySession
+from AsyncSynergySession import CommandFuture
+from RetryPolicy import RetryPolicy
+from SynergyMetrics import MetricsRegistry
 from Queue import Queue
+from threading import Thread
 
 sys.stdout =  os.fdopen(sys.stdout.fileno(), 'w', 0);
 sys.stderr =  os.fdopen(sys.stderr.fileno(), 'w', 0);
@@ -33,22 +37,32 @@ sys.stderr =  os.fdopen(sys.stderr.fileno(), 'w', 0);
 class SynergySessions(object):
     """This class is a wrapper around a pool of cm synergy sessions"""
 
-    def __init__(self, database, engine=None, command_name='ccm', ccm_ui_path='/dev/null', ccm_eng_path='/dev/null', nr_sessions=2):
+    def __init__(self, database, engine=None, command_name='ccm', ccm_ui_path='/dev/null', ccm_eng_path='/dev/null', nr_sessions=2, interactive=False, retry_policy=None, metrics=None, backend=None, cache=None):
         self.database = database
         self.command_name = command_name
         self.ccm_ui_path = ccm_ui_path
         self.ccm_eng_path = ccm_eng_path
         self.engine = engine
         self.nr_sessions = nr_sessions
+        self.interactive = interactive
+        # one policy and registry for the pool, so the statistics are aggregated over all sessions
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.metrics = metrics or MetricsRegistry()
+        self.backend = backend
+        self.cache = cache
         self.max_session_index = nr_sessions-1
         
         """populate and array with synergy sessions"""
         self.sessionArray = {}
         for i in range (self.nr_sessions):
             print "starting session [" + str(i) + "]"
-            self.sessionArray[i] = SynergySession.SynergySession(self.database, self.engine, self.command_name, self.ccm_ui_path, self.ccm_eng_path)
+            self.sessionArray[i] = SynergySession.SynergySession(self.database, self.engine, self.command_name, self.ccm_ui_path, self.ccm_eng_path, self.interactive, self.retry_policy, self.metrics, self.backend, self.cache)
             self.sessionArray[i].setSessionID(i)
-            
+
+        # work queue shared by all sessions, see submit()
+        self.work = Queue()
+        self.workers = []
+
 
     def __getitem__(self, index):
         if ((index > self.max_session_index) or (index < 0)):
@@ -56,6 +70,45 @@ class SynergySessions(object):
         session = self.sessionArray[index];
         return session
 
+    def submit(self, fn, *args, **kwargs):
+        """Run fn(session, *args) on the first idle session of the pool.
+
+        Returns a CommandFuture holding the return value of fn. With done=queue the future is put
+        on the queue when it is finished, so one queue collects the futures of a whole loop"""
+        done = kwargs.pop('done', None)
+        if kwargs:
+            raise TypeError("submit() got an unexpected keyword argument '%s'" % kwargs.keys()[0])
+        if not self.workers:
+            for i in range(self.nr_sessions):
+                t = Thread(target=self._worker, args=(self.sessionArray[i],))
+                t.daemon = True
+                t.start()
+                self.workers.append(t)
+        future = CommandFuture()
+        if done is not None:
+            future.add_done_callback(done.put)
+        self.work.put((fn, args, future))
+        return future
+
+    def _worker(self, session):
+        while True:
+            item = self.work.get()
+            if item is None:
+                break
+            fn, args, future = item
+            try:
+                future.set_result(fn(session, *args))
+            except Exception, e:
+                future.set_exception(e)
+
+    def shutdown(self):
+        """Stop the worker threads once the queued work is done"""
+        for t in self.workers:
+            self.work.put(None)
+        for t in self.workers:
+            t.join()
+        self.workers = []
+
     def __str__(self):
         retstring = ''
         for i in range (self.nr_sessions):
@@ -64,7 +117,6 @@ class SynergySessions(object):
 
  
 
-
 def main():
     """Test: start a bunch of sessions in parallel, start commands on each, wait for them all to return and print the result in execution order"""
     ccmpool = SynergySessions(database='/nokia/co_nmp/groups/gscm/dbs/co1asset', nr_sessions=2)
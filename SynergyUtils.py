@@ -14,25 +14,78 @@ import TaskObject
 from datetime import datetime
 import re
 from operator import itemgetter
-from itertools import product
+from collections import OrderedDict
 import os.path
 import os
-from threading import Thread
+from threading import Thread, Lock
 from Queue import Queue
 
+class PathCache(object):
+    """Paths of projects per release, shared by the CCMFilePath of all sessions in a pool.
+
+    Thread safe, holds at most max_entries paths and drops the least recently used ones"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.lock = Lock()
+        self.paths = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, release, object_name, path):
+        with self.lock:
+            key = (release, object_name)
+            if key in self.paths:
+                del self.paths[key]
+            self.paths[key] = path
+            if len(self.paths) > self.max_entries:
+                self.paths.popitem(last=False)
+
+    def find(self, release, object_names):
+        """The first of object_names with a cached path in release as (object_name, path), or None"""
+        with self.lock:
+            for object_name in object_names:
+                key = (release, object_name)
+                if key in self.paths:
+                    path = self.paths.pop(key)
+                    self.paths[key] = path
+                    self.hits += 1
+                    return object_name, path
+            self.misses += 1
+            return None
+
+    def statistics(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.paths)}
+
+    def __str__(self):
+        stats = self.statistics()
+        lookups = max(1, stats['hits'] + stats['misses'])
+        return "%d hits %d misses %.1f%% hit rate, %d paths cached" % (stats['hits'], stats['misses'], 100.0 * stats['hits'] / lookups, stats['entries'])
+
+
 class CCMFilePath(object):
     """Get the file path of an object from Synergy"""
 
-    def __init__(self, ccm):
+    finduse_line = re.compile("^(.+)-(.+?)@(.*)$")
+
+    def __init__(self, ccm, path_index=None, path_cache=None):
 
         self.ccm = ccm
         self.top_reached = None
         self.delim = self.ccm.delim()
-        self.path_lookup = {}
+        # Paths of the projects found so far, possibly shared with other sessions
+        self.path_cache = path_cache or PathCache()
         #self.project_lookup = {}
+        # Optional ProjectPathIndex answering for the members of indexed releases
+        self.path_index = path_index
 
     def get_path(self, object_name, current_release):
         # Get the path of object
+        if self.path_index:
+            path = self.path_index.lookup(object_name, current_release)
+            if path:
+                return path
         self.top_reached = None
         self.current_release = current_release
         result = self.recurse_file_path(object_name)
@@ -42,62 +95,54 @@ class CCMFilePath(object):
     def recurse_file_path(self, object_name):
         ret_val = None
         #print "Object:", object_name
-        result = self.ccm.finduse(object_name).option("-released_proj").run().splitlines()
-        #lets first try to see if any of the cached projects are already in the list
-        r = [(k,j) for (k,j) in product(self.path_lookup.keys(), result) if k in j]
-        if r:
-            print "Trying", r[0][1], "first for", object_name
-            #put the matching project to end of array
-            result.remove(r[0][1])
-            result.append(r[0][1])
+        result = []
+        for s in self.ccm.finduse(object_name).option("-released_proj").run().splitlines():
+            m = self.finduse_line.match(s.strip())
+            if m:
+                # (path, child version, parent project)
+                result.append(m.groups())
 
         #reverse the list, as the matching project is mostly in the latter part
         result.reverse()
-        for s in result:
+        #lets first try to see if any of the cached projects are already in the list
+        cached = self.path_cache.find(self.current_release, [parentproject for path, childversion, parentproject in result])
+        if cached:
+            for line in result:
+                if line[2] == cached[0]:
+                    print "Trying", line[0] + '-' + line[1] + '@' + line[2], "first for", object_name
+                    self.top_reached = 1
+                    # Add remaning path
+                    p = [cached[1]]
+                    p.extend(line[0].split('/')[1:])
+                    return '/'.join(p)
+
+        for path, childversion, parentproject in result:
             if not self.top_reached:
-                s = s.strip()
-                # match
-                p = re.compile("^(.+)-(.+?)@(.*)$")
-                m = p.match(s)
-                if m:
-                    path = m.group(1)
-                    childversion = m.group(2)
-                    parentproject = m.group(3)
-
-                    if parentproject == self.current_release:
-                        #print 'Top reached'
-                        self.top_reached = 1
-                        # add to lookup table
-                        self.path_lookup[object_name] = path
-                        return path
-                    else:
-                        #try lookup table
-                        if parentproject in self.path_lookup.keys():
-                            #print "Path cached for:", object_name, self.path_lookup[parentproject]
-                            self.top_reached = 1
-                            # Add remaning path
-                            p = [self.path_lookup[parentproject]]
-                            p.extend(path.split('/')[1:])
-                            p = '/'.join(p)
-                            return p
-
-                        if ':project:' not in parentproject:
-                            #Sometimes the greatness of Synergy will return a name-version instead of a four-part-name, so convert it into a four-part-name:
-                            splitted_name = parentproject.split(self.delim)
-                            fourpart = self.ccm.query("name='{0}' and version='{1}' and type='project'".format(splitted_name[0], splitted_name[1])).format('%objectname').run()
-                            if fourpart:
-                                parentproject = fourpart[0]['objectname']
-
-                        parent = self.recurse_file_path(parentproject)
-                        if parent:
-                            p = [parent]
-                            p.extend(path.split('/')[1:])
-                            p = '/'.join(p)
-                            #Only add path and  if we are processing a project
-                            if ':project:' in object_name:
-                                # add this project to lookup table with complete path
-                                self.path_lookup[object_name] = p
-                            return p
+                if parentproject == self.current_release:
+                    #print 'Top reached'
+                    self.top_reached = 1
+                    # add to lookup table
+                    if ':project:' in object_name:
+                        self.path_cache.put(self.current_release, object_name, path)
+                    return path
+                else:
+                    if ':project:' not in parentproject:
+                        #Sometimes the greatness of Synergy will return a name-version instead of a four-part-name, so convert it into a four-part-name:
+                        splitted_name = parentproject.split(self.delim)
+                        fourpart = self.ccm.query("name='{0}' and version='{1}' and type='project'".format(splitted_name[0], splitted_name[1])).format('%objectname').run()
+                        if fourpart:
+                            parentproject = fourpart[0]['objectname']
+
+                    parent = self.recurse_file_path(parentproject)
+                    if parent:
+                        p = [parent]
+                        p.extend(path.split('/')[1:])
+                        p = '/'.join(p)
+                        #Only add path and  if we are processing a project
+                        if ':project:' in object_name:
+                            # add this project to lookup table with complete path
+                            self.path_cache.put(self.current_release, object_name, p)
+                        return p
 
         return ret_val
 
@@ -149,9 +194,12 @@ class TaskUtil(object):
 
 
 
-    def fill_task_info(self, task):
+    def fill_task_info(self, task, attributes=None):
+        """attributes are the task's attributes if they were fetched already, see SynergyUtils.get_attributes"""
         print "Fetching task info", task.get_object_name()
-        task.set_attributes(self.synergy_utils.get_non_blacklisted_attributes(task))
+        if attributes is None:
+            attributes = self.synergy_utils.get_non_blacklisted_attributes(task)
+        task.set_attributes(attributes)
         #Find related task (s30)
         releated_task = self.ccm.query("has_task_in_CUIinsp('{0}')".format(task.get_object_name())).format('%objectname').format("%owner").format("%status").format("%create_time").format("%task").run()
         #There should be only one releated task - inspection task
@@ -198,11 +246,15 @@ class TaskUtil(object):
 
 class ObjectHistoryPool(object):
     """ Wrap a bunch of ObjectHistory objects in one indexable pool object, """
-    def __init__(self, ccmpool, current_release, old_release = None):
+    def __init__(self, ccmpool, current_release, old_release = None, version_graph = None, path_index = None, project_lineage = None, membership_index = None, blob_store = None):
         self.ccmpool = ccmpool
         self.objectHistoryArray = {}
+        # Optional store of file contents for all sessions of the pool
+        self.blob_store = blob_store
+        # one cache of project paths for all sessions of the pool
+        self.path_cache = PathCache()
         for i in range (self.ccmpool.nr_sessions):
-            self.objectHistoryArray[i] = ObjectHistory(ccmpool[i], current_release, old_release)
+            self.objectHistoryArray[i] = ObjectHistory(ccmpool[i], current_release, old_release, version_graph, path_index, self.path_cache, project_lineage, membership_index, self.blob_store)
 
     def __getitem__(self, index):
         if ((index > self.ccmpool.max_session_index) or (index < 0)):
@@ -214,25 +266,39 @@ class ObjectHistoryPool(object):
 class ObjectHistory(object):
     """ Get the history of one object backwards in time """
 
-    def __init__(self, ccm, current_release, old_release = None):
+    def __init__(self, ccm, current_release, old_release = None, version_graph = None, path_index = None, path_cache = None, project_lineage = None, membership_index = None, blob_store = None):
         self.ccm = ccm
         self.delim = ccm.delim()
+        # Optional VersionGraph with preloaded version trees, used instead of a query per hop
+        self.version_graph = version_graph
         self.history = {}
         self.synergy_utils = SynergyUtils(self.ccm)
         self.current_release = current_release
-        self.ccm_file_path = CCMFilePath(ccm)
+        # Optional ProjectPathIndex of the current and old release, shared with the other sessions
+        self.ccm_file_path = CCMFilePath(ccm, path_index, path_cache)
         self.old_release = old_release
-        self.dir = 'data/' + self.current_release.split(self.delim)[1].split(':')[0]
+        # Optional BlobStore of file contents, shared with the other sessions and releases
+        self.blob_store = blob_store
         self.release_lookup = {}
-        if old_release:
-            #Fill subproject old list
-            sub = self.ccm.query("recursive_is_member_of('{0}', 'none') and type='project'".format(old_release)).format('%objectname').run()
-            self.old_subproject_list = [s['objectname'] for s in sub]
-            self.old_subproject_list.append(old_release)
-        #Fill subproject current list
-        sub = self.ccm.query("recursive_is_member_of('{0}', 'none') and type='project'".format(current_release)).format('%objectname').run()
-        self.current_subproject_list = [s['objectname'] for s in sub]
-        self.current_subproject_list.append(current_release)
+        # Optional ProjectLineage prepared for current_release and old_release, shared with the other sessions
+        self.project_lineage = project_lineage
+        # project_is_some_predecessor answers for the projects outside the lineage
+        self.some_predecessor_lookup = {}
+        # Optional ReleaseMembershipIndex of current_release and old_release, shared with the other sessions
+        self.membership_index = membership_index
+        if membership_index:
+            self.old_subproject_list = membership_index.get_subprojects(old_release) if old_release else set()
+            self.current_subproject_list = membership_index.get_subprojects(current_release)
+        else:
+            if old_release:
+                #Fill subproject old list
+                sub = self.ccm.query("recursive_is_member_of('{0}', 'none') and type='project'".format(old_release)).format('%objectname').run_iter()
+                self.old_subproject_list = set([s['objectname'] for s in sub])
+                self.old_subproject_list.add(old_release)
+            #Fill subproject current list
+            sub = self.ccm.query("recursive_is_member_of('{0}', 'none') and type='project'".format(current_release)).format('%objectname').run_iter()
+            self.current_subproject_list = set([s['objectname'] for s in sub])
+            self.current_subproject_list.add(current_release)
         self.q = Queue()
 
     def start_get_history(self, objectholder):
@@ -252,6 +318,18 @@ class ObjectHistory(object):
         self.q.put(retval)
         return retval
 
+    def store_content(self, fileobject, base=None):
+        """Cat the object into the blob store, unless its content is there already or there is no store.
+
+        base is another version of the file, stored already, its content may be a delta to"""
+        if not self.blob_store:
+            return
+        if self.blob_store.has(fileobject.get_object_name()):
+            self.blob_store.skip()
+            return
+        content = self.ccm.cat(fileobject.get_object_name()).run()
+        self.blob_store.put(fileobject.get_object_name(), content, base)
+
     def get_history(self, fileobject):
         #print ""
         print 'Processing:', fileobject.get_object_name(), "from", self.current_release, "to", self.old_release
@@ -261,12 +339,7 @@ class ObjectHistory(object):
         path = self.ccm_file_path.get_path(fileobject.get_object_name(), self.current_release)
 
         fileobject.set_path(path)
-        content = self.ccm.cat(fileobject.get_object_name()).run()
-        if not os.path.exists(self.dir):
-            os.makedirs(self.dir)
-        f = open(self.dir + '/' + fileobject.get_object_name(), 'wb')
-        f.write(content)
-        f.close()
+        self.store_content(fileobject)
 
         fileobject.set_attributes(self.synergy_utils.get_non_blacklisted_attributes(fileobject))
 
@@ -274,7 +347,7 @@ class ObjectHistory(object):
             #handle directory objects
             if fileobject.get_type() == 'dir':
                 #get predecessors and do a diff on dir objects
-                predecessors = self.ccm.query("is_predecessor_of('{0}')".format(fileobject.get_object_name())).format("%owner").format("%status").format("%create_time").format("%task").run()
+                predecessors = self.get_predecessors(fileobject.get_object_name())
                 for p in predecessors:
                     predecessor = FileObject.FileObject(p['objectname'], fileobject.get_separator(), p['owner'], p['status'], p['create_time'], p['task'])
                     fileobject.add_dir_changes(self.synergy_utils.get_dir_changes(fileobject, predecessor))
@@ -299,7 +372,7 @@ class ObjectHistory(object):
         delim = fileobject.get_separator()
         print ""
         print 'Processing:', fileobject.get_object_name(), fileobject.get_status()
-        predecessors = self.ccm.query("is_predecessor_of('{0}')".format(fileobject.get_object_name())).format("%owner").format("%status").format("%create_time").format("%task").run()
+        predecessors = self.get_predecessors(fileobject.get_object_name())
         for p in predecessors:
             predecessor = FileObject.FileObject(p['objectname'], delim, p['owner'], p['status'], p['create_time'], p['task'])
             print "Predecessor:", predecessor.get_object_name()
@@ -317,13 +390,19 @@ class ObjectHistory(object):
             path = self.ccm_file_path.get_path(predecessor.get_object_name(), self.old_release)
             # check predecessor release to see if this object should be added to the set.
             if self.old_release:
+                if self.membership_index and (self.membership_index.is_member(predecessor.get_object_name(), self.current_release) or
+                                              self.membership_index.is_member(predecessor.get_object_name(), self.old_release)):
+                    # Object is already released, continue with the next predecessor
+                    print predecessor.get_object_name(), "is already released"
+                    continue
 
-                # Get the release(s) for the predecessor
+                # Get the release(s) for the predecessor, they are needed to relate them to the old release
                 releases = self.ccm.query("has_member('{0}') and status='released'".format(predecessor.get_object_name())).format('%objectname').format('%create_time').run()
                 if releases:
                     #print '\n'.join([r['objectname'] for r in releases])
-                    # Check if the "old" release is the the releases for the predecessor and stop if true
-                    if [r['objectname'] for r in releases if r['objectname'] in self.current_subproject_list or r['objectname'] in self.old_subproject_list]:
+                    # Check if the "old" release is the the releases for the predecessor and stop if true.
+                    # The membership index has answered that already
+                    if not self.membership_index and [r['objectname'] for r in releases if r['objectname'] in self.current_subproject_list or r['objectname'] in self.old_subproject_list]:
                         # Object is already released, continue with the next predecessor
                         print predecessor.get_object_name(), "is already released"
                         continue
@@ -358,18 +437,24 @@ class ObjectHistory(object):
                     path = fileobject.get_path()
 
                 predecessor.set_path(path)
-                content = self.ccm.cat(predecessor.get_object_name()).run()
+                self.store_content(predecessor, fileobject.get_object_name())
                 #predecessor.set_content(content)
-                if not os.path.exists(self.dir):
-                    os.makedirs(self.dir)
-                fname = self.dir + '/' + predecessor.get_object_name()
-                f = open(fname, 'wb')
-                f.write(content)
-                f.close()
                 predecessor.add_successor(fileobject.get_object_name())
                 self.recursive_get_history(predecessor)
                 self.add_to_history(predecessor)
 
+    def get_predecessors(self, object_name):
+        """Direct predecessors of the object, from the version graph when it knows the object"""
+        if self.version_graph and self.version_graph.is_complete(object_name):
+            return self.version_graph.get_predecessors(object_name)
+        return self.ccm.query("is_predecessor_of('{0}')".format(object_name)).format("%owner").format("%status").format("%create_time").format("%task").run()
+
+    def get_successors(self, object_name):
+        """Direct successors of the object, from the version graph when it knows the object"""
+        if self.version_graph and self.version_graph.is_complete(object_name):
+            return self.version_graph.get_successors(object_name)
+        return self.ccm.query("is_successor_of('{0}')".format(object_name)).format("%owner").format("%status").format("%create_time").format("%task").run()
+
     def sort_releases_by_create_time(self, releases):
         rels = [(r['objectname'], datetime.strptime(r['create_time'], "%a %b %d %H:%M:%S %Y")) for r in releases]
         r = sorted(rels, key=itemgetter(1), reverse=True)
@@ -378,6 +463,17 @@ class ObjectHistory(object):
 
     def project_is_some_predecessor(self, project):
         print "Checking if", project, "is some predecessor of", self.current_release, "or", self.old_release, "..."
+        if self.project_lineage:
+            ret_val = self.project_lineage.is_some_predecessor(self.ccm, project)
+            if ret_val is not None:
+                return ret_val
+        if project not in self.some_predecessor_lookup:
+            # a project seen again while its lineage is explored leads nowhere new
+            self.some_predecessor_lookup[project] = False
+            self.some_predecessor_lookup[project] = self.query_project_is_some_predecessor(project)
+        return self.some_predecessor_lookup[project]
+
+    def query_project_is_some_predecessor(self, project):
         successors = self.ccm.query("has_baseline_project('{0}') and status='released'".format(project)).format("%objectname").run()
         for successor in successors:
             successor = successor['objectname']
@@ -397,24 +493,30 @@ class ObjectHistory(object):
     def successor_is_released(self, predecessor, fileobject):
         print "Checking if successor is released, for", fileobject.get_object_name(), "by predecessor", predecessor.get_object_name()
         ret_val = False
-        successors = self.ccm.query("is_successor_of('{0}')".format(predecessor.get_object_name())).format("%owner").format("%status").format("%create_time").format("%task").run()
+        successors = self.get_successors(predecessor.get_object_name())
         for s in successors:
-            if s['objectname'] in self.release_lookup.keys():
+            if s['objectname'] in self.release_lookup:
                 return self.release_lookup[s['objectname']]
             if s['objectname'] != fileobject.get_object_name():
                 s = FileObject.FileObject(s['objectname'], predecessor.get_separator(), s['owner'], s['status'], s['create_time'], s['task'])
                 print "successor:", s.get_object_name()
                 #check releases of successor
-                releases = self.ccm.query("has_member('{0}') and status='released'".format(s.get_object_name())).format('%objectname').format('%create_time').run()
-                #print '\n'.join([r['objectname'] for r in releases])
-                if [r['objectname'] for r in releases if r['objectname'] in self.old_subproject_list]:
+                if self.membership_index:
+                    released_in_old = self.membership_index.is_member(s.get_object_name(), self.old_release)
+                    released_in_current = self.membership_index.is_member(s.get_object_name(), self.current_release)
+                else:
+                    releases = self.ccm.query("has_member('{0}') and status='released'".format(s.get_object_name())).format('%objectname').format('%create_time').run()
+                    #print '\n'.join([r['objectname'] for r in releases])
+                    released_in_old = [r['objectname'] for r in releases if r['objectname'] in self.old_subproject_list]
+                    released_in_current = [r['objectname'] for r in releases if r['objectname'] in self.current_subproject_list]
+                if released_in_old:
                     print "successor:", s.get_object_name(), "is released"
                     self.release_lookup[s.get_object_name()] = True
                     return True
-                elif [r['objectname'] for r in releases if r['objectname'] in self.current_subproject_list]:
+                elif released_in_current:
                     print "successor:", s.get_object_name(), "is released in current project, don't continue"
-                    return False
                     self.release_lookup[s.get_object_name()] = False
+                    return False
                 else:
                     ret_val = self.successor_is_released(s, fileobject)
                     self.release_lookup[s.get_object_name()] = ret_val
@@ -437,22 +539,43 @@ class SynergyUtils(object):
         'registration_date', 'source']
 
     def get_non_blacklisted_attributes(self, obj):
-        attr_list = self.ccm.attr(obj.get_object_name()).option('-l').run().splitlines()
-        attributes = {}
-        for attr in attr_list:
-            attr = attr.partition(' ')[0]
-            if attr not in self.attribute_blacklist:
-                print "setting attribute:", attr
-                attributes[attr] = self.ccm.attr(obj.get_object_name()).option('-s').option(attr).run()
-        return attributes
-    
+        return self.get_attributes([obj], self.attribute_blacklist)[obj.get_object_name()]
+
     def get_all_attributes(self, obj):
-        attr_list = self.ccm.attr(obj.get_object_name()).option('-l').run().splitlines()
+        return self.get_attributes([obj])[obj.get_object_name()]
+
+    def get_attributes(self, objects, blacklist=()):
+        """Attributes of many objects, without the blacklisted ones, as {objectname: {attribute: value}}.
+
+        Every object needs one attr -l; then the values of all objects with the same attribute
+        names are read with formatted queries instead of one attr -s per attribute. Values end
+        with a newline like the output of attr -s, multi-line values are kept whole"""
+        groups = {}
+        for obj in objects:
+            names = []
+            for attr in self.ccm.attr(obj.get_object_name()).option('-l').run().splitlines():
+                attr = attr.partition(' ')[0]
+                if attr and attr not in blacklist:
+                    names.append(attr)
+            groups.setdefault(tuple(names), []).append(obj)
+
         attributes = {}
-        for attr in attr_list:
-            attr = attr.partition(' ')[0]
-            print "setting attribute:", attr
-            attributes[attr] = self.ccm.attr(obj.get_object_name()).option('-s').option(attr).run()
+        for names, group in groups.iteritems():
+            print "setting attributes:", ', '.join(names)
+            if not names:
+                for obj in group:
+                    attributes[obj.get_object_name()] = {}
+                continue
+            results = self.ccm.query_many(group, lambda o: "name={0} and version={1} and type={2} and instance={3}".format(
+                                              *[SynergySession.query_literal(v) for v in (o.get_name(), o.get_version(), o.get_type(), o.get_instance())]),
+                                          format=['%' + attr for attr in names],
+                                          key_token=lambda o: o.get_object_name(),
+                                          row_token=lambda row: row['objectname'],
+                                          strip=False)
+            for obj, rows in results.iteritems():
+                if not rows:
+                    raise SynergySession.SynergyException('No attributes found for ' + obj.get_object_name())
+                attributes[obj.get_object_name()] = dict([(attr, rows[0][attr] + '\n') for attr in names])
         return attributes
 
     def get_dir_changes(self, fileobject, predecessor):
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+VersionGraph.py
+
+The predecessor/successor graph of object versions, pulled in bulk with the ccm history command
+
+Copyright (c) 2011 Nokia. All rights reserved.
+"""
+
+class VersionGraph(object):
+    """Version trees of many objects, so history can be walked without a query per hop.
+
+    The rows have the same keys as the rows of an is_predecessor_of query:
+    objectname, owner, status, create_time and task"""
+
+    row_format = ['%owner', '%status', '%create_time', '%task']
+
+    def __init__(self):
+        self.rows = {}
+        self.predecessors = {}
+        self.successors = {}
+        # (name, type, instance) of the objects whose complete version tree is loaded
+        self.families = set()
+        self.num_of_cmds = 0
+
+    def extract(self, ccm, objectnames):
+        """Load the version trees of all the objects, with one hist argument per object family.
+
+        objectnames can be any iterable, it is consumed as it goes: a hist command runs as soon
+        as its arguments fill query_max_length"""
+        batch = []
+        length = 0
+        for objectname in objectnames:
+            family = ccm.object_family(objectname)
+            if family in self.families:
+                continue
+            self.families.add(family)
+            if batch and length + len(objectname) + 1 > ccm.query_max_length:
+                self._hist(ccm, batch)
+                batch = []
+            length = length + len(objectname) + 1 if batch else len(objectname)
+            batch.append(objectname)
+        if batch:
+            self._hist(ccm, batch)
+
+    def _hist(self, ccm, batch):
+        ccm.hist(batch)
+        for f in self.row_format:
+            ccm.format(f)
+        for row in ccm.run():
+            self.add(row)
+        self.num_of_cmds += 1
+
+    def add(self, row):
+        objectname = row['objectname']
+        self.predecessors[objectname] = row.pop('predecessors')
+        self.successors[objectname] = row.pop('successors')
+        self.rows[objectname] = row
+
+    def get_predecessors(self, objectname):
+        """Rows of the direct predecessors of the object"""
+        return [self.rows[p] for p in self.predecessors[objectname] if p in self.rows]
+
+    def get_successors(self, objectname):
+        """Rows of the direct successors of the object"""
+        return [self.rows[s] for s in self.successors[objectname] if s in self.rows]
+
+    def is_complete(self, objectname):
+        """True if all the neighbours of the object are known, so the graph can answer for it"""
+        if objectname not in self.rows:
+            return False
+        for o in self.predecessors[objectname] + self.successors[objectname]:
+            if o not in self.rows:
+                return False
+        return True
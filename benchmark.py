@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+benchmark.py
+
+End-to-end benchmark of fetching, graphing and exporting the history of a synthetic Synergy database.
+
+Usage: benchmark.py [options], see benchmark.py --help
+The results are written as json; give a stored result with --baseline to fail on regressions.
+
+Copyright (c) 2011 Nokia. All rights reserved.
+"""
+
+import os
+import sys
+import imp
+import json
+import time
+import shutil
+import resource
+import tempfile
+from optparse import OptionParser
+
+import SynergySession
+import SynergySessions
+from SynergyMetrics import MetricsRegistry
+from SynergyCache import QueryCache
+from HistoryStore import LazyHistory
+from BlobStore import BlobStore
+from synthetic_ccm import SyntheticDatabase, SyntheticBackend
+
+root = os.path.dirname(os.path.abspath(__file__))
+
+def peak_rss():
+    """Peak resident set size of the process in kB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_stage(results, name, log, function, *args):
+    """Run one stage with its output going to log and record time, peak RSS and whether it ran"""
+    stdout = sys.stdout
+    sys.stdout = log
+    start = time.time()
+    try:
+        try:
+            value = function(*args)
+            status = 'ok'
+        except ImportError, e:
+            value = None
+            status = 'skipped: %s' % e
+    finally:
+        sys.stdout = stdout
+    results['stages'][name] = {'seconds': time.time() - start, 'peak_rss_kb': peak_rss(), 'status': status}
+    print "%-8s %-40s %8.2f s %10d kB" % (name, status, results['stages'][name]['seconds'], results['stages'][name]['peak_rss_kb'])
+    return value
+
+def fetch_history(options, db, metrics, cache):
+    fetch = imp.load_source('fetch_ccm_history', os.path.join(root, 'fetch-ccm-history.py'))
+    if options.process:
+        fname = os.path.abspath('synthetic_db.p')
+        db.save(fname)
+        os.environ['SYNTHETIC_CCM_DB'] = fname
+        os.environ['SYNTHETIC_CCM_LATENCY'] = str(options.latency)
+        command_name = os.path.join(root, 'synthetic_ccm.py')
+        backend = None
+    else:
+        command_name = 'ccm'
+        backend = SyntheticBackend(db, options.latency)
+    ccm = SynergySession.SynergySession('synthetic', command_name=command_name, metrics=metrics, backend=backend, cache=cache)
+    ccmpool = SynergySessions.SynergySessions(database='synthetic', command_name=command_name, nr_sessions=options.sessions, metrics=metrics, backend=backend, cache=cache)
+    history = fetch.CCMHistory(ccm, ccmpool, {}, 'history').get_project_history('prod')
+    ccmpool.shutdown()
+    return history
+
+def fast_export(history):
+    """Graph and export every release in one walk"""
+    from ccm_history_to_graphs import create_graphs_from_releases
+    from ccm_fast_export import ccm_fast_export
+    ccm_fast_export(history, create_graphs_from_releases(history, draw=False), BlobStore('history_blobs'))
+
+def disk_usage(directory):
+    """Bytes in the files below directory"""
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for fname in filenames:
+            total += os.path.getsize(os.path.join(dirpath, fname))
+    return total
+
+def compare(results, baseline, tolerance):
+    """Returns the regressions of results against baseline: slower stages, more RSS or more ccm commands"""
+    regressions = []
+    parameters = [k for k, v in results['parameters'].iteritems() if k != 'tolerance' and baseline['parameters'].get(k) != v]
+    if parameters:
+        return ["the baseline was run with other parameters: %s" % ', '.join(sorted(parameters))]
+    for name, stage in results['stages'].iteritems():
+        base = baseline['stages'].get(name)
+        if not base or base['status'] != 'ok' or stage['status'] != 'ok':
+            continue
+        if stage['seconds'] > base['seconds'] * (1 + tolerance):
+            regressions.append("%s: %.2f s, baseline %.2f s" % (name, stage['seconds'], base['seconds']))
+    if results['peak_rss_kb'] > baseline['peak_rss_kb'] * (1 + tolerance):
+        regressions.append("peak RSS: %d kB, baseline %d kB" % (results['peak_rss_kb'], baseline['peak_rss_kb']))
+    for command_type, count in results['commands'].iteritems():
+        if count > baseline['commands'].get(command_type, 0) * (1 + tolerance):
+            regressions.append("ccm %s: %d commands, baseline %d" % (command_type, count, baseline['commands'].get(command_type, 0)))
+    return regressions
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('--objects', type='int', default=200, help='number of files')
+    parser.add_option('--versions', type='int', default=4, help='maximum number of versions per file')
+    parser.add_option('--tasks', type='int', default=50, help='number of tasks')
+    parser.add_option('--releases', type='int', default=4, help='number of releases')
+    parser.add_option('--depth', type='int', default=3, help='directory depth')
+    parser.add_option('--merge-frequency', type='float', default=0.1, help='fraction of versions with a merged parallel version')
+    parser.add_option('--attributes', type='int', default=5, help='extra attributes per object')
+    parser.add_option('--seed', type='int', default=0)
+    parser.add_option('--sessions', type='int', default=4, help='number of Synergy sessions in the pool')
+    parser.add_option('--latency', type='float', default=0.0, help='seconds added to every ccm command')
+    parser.add_option('--process', action='store_true', default=False, help='run synthetic_ccm.py as the ccm executable instead of in process')
+    parser.add_option('--cache', help='ccm answer cache file, reused by the next run with the same --seed')
+    parser.add_option('--output', default='benchmark.json', help='where to write the results')
+    parser.add_option('--baseline', help='results of an earlier run to compare against')
+    parser.add_option('--tolerance', type='float', default=0.2, help='allowed relative increase over the baseline')
+    options, args = parser.parse_args()
+
+    output = os.path.abspath(options.output)
+    baseline = None
+    if options.baseline:
+        f = open(options.baseline)
+        baseline = json.load(f)
+        f.close()
+
+    results = {'parameters': dict([(k, v) for k, v in vars(options).iteritems() if k not in ['output', 'baseline', 'cache']]), 'stages': {}}
+    metrics = MetricsRegistry()
+    cache = None
+    if options.cache:
+        cache = QueryCache(os.path.abspath(options.cache))
+
+    # the pipeline writes its data and logs to the working directory
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix='pysynergy_benchmark_')
+    os.chdir(workdir)
+    log = open('benchmark.log', 'w')
+    try:
+        db = run_stage(results, 'generate', log, SyntheticDatabase, options.objects, options.versions, options.tasks, options.releases,
+                       options.depth, options.merge_frequency, options.attributes, options.seed)
+        history = run_stage(results, 'fetch', log, fetch_history, options, db, metrics, cache)
+        # graphs and export walk the stored releases once, reading them one at a time as load_data.py does
+        stored = LazyHistory('history')
+        run_stage(results, 'export', log, fast_export, stored)
+        stored.close()
+        results['data_bytes'] = disk_usage('history_blobs')
+    finally:
+        log.close()
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+
+    objects = sum([len(r['objects']) for r in history.values()])
+    commands = metrics.snapshot()['commands']
+    results['objects'] = objects
+    results['tasks'] = sum([len(r['tasks']) for r in history.values()])
+    results['objects_per_second'] = objects / results['stages']['fetch']['seconds']
+    results['commands'] = dict([(k, c['count']) for k, c in commands.iteritems()])
+    results['commands_per_object'] = sum(results['commands'].values()) / float(max(1, objects))
+    results['peak_rss_kb'] = peak_rss()
+
+    print "objects: %d, tasks: %d, %.1f objects/s, %.2f ccm commands per object, peak RSS %d kB, %d bytes of data" % (
+        objects, results['tasks'], results['objects_per_second'], results['commands_per_object'], results['peak_rss_kb'], results['data_bytes'])
+    print metrics
+    if cache:
+        results['cache'] = cache.statistics()
+        print cache
+        cache.close()
+
+    f = open(output, 'w')
+    json.dump(results, f, indent=2, sort_keys=True)
+    f.close()
+    print "results written to", output
+
+    if baseline:
+        regressions = compare(results, baseline, options.tolerance)
+        for r in regressions:
+            print "REGRESSION", r
+        if regressions:
+            sys.exit(1)
+        print "no regressions against", options.baseline
+
+
+if __name__ == '__main__':
+    main()
@@ -16,7 +16,12 @@ from operator import itemgetter, attrgetter
 from collections import deque
 from pygraph.classes.digraph import digraph
 
-def ccm_fast_export(releases, graphs):
+def ccm_fast_export(releases, graphs, blob_store):
+    """Print the releases as git fast-import commands.
+
+    graphs yields (release, graphs of the release) in the order of the releases after the initial
+    one, as create_graphs_from_releases does, so every release is graphed and exported in one walk
+    and its graphs are dropped once its commits are written"""
     logger.basicConfig(filename='ccm_fast_export.log',level=logger.DEBUG)
 
     commit_lookup = {}
@@ -34,7 +39,7 @@ def ccm_fast_export(releases, graphs):
     #Create the initial release
     for o in releases[release]['objects']:
         if o.get_type() != 'dir':
-            mark = create_blob(o, get_mark(mark), release)
+            mark = create_blob(o, get_mark(mark), blob_store)
             files.append('M 100644 :'+str(mark) + ' ' + o.get_path())
 
     mark = get_mark(mark)
@@ -54,10 +59,16 @@ def ccm_fast_export(releases, graphs):
 
     commit_lookup[release] = mark
     # do the following releases (graphs)
+    graphs = iter(graphs)
     release = releases[release]['next']
     while release:
         logger.info("Next release: %s" %(release))
-        commit_graph = graphs[release]['commit']
+        graphed, release_graphs = next(graphs)
+        if graphed != release:
+            raise ValueError("graphs of %s given for release %s" % (graphed, release))
+        # only the graphs of the release being exported are kept
+        current_graphs = {release: release_graphs}
+        commit_graph = release_graphs['commit']
         commit_graph = fix_orphan_nodes(commit_graph, releases[release]['previous'])
         neighbors = deque(commit_graph.neighbors(releases[release]['previous']))
 
@@ -76,7 +87,7 @@ def ccm_fast_export(releases, graphs):
                 continue
             reference = [commit_lookup[i] for i in commit_graph.incidents(n)]
             # create blobs and commit message for task/object
-            mark = create_commit(n, release, releases, mark, reference, graphs)
+            mark = create_commit(n, release, releases, mark, reference, current_graphs, blob_store)
 
             commit_lookup[n] = mark
             # Get neighbors for this node
@@ -116,7 +127,7 @@ def create_release_merge_commit(releases, release, mark, reference):
     logger.info("git-fast-import MERGE-COMMIT:\n%s" %('\n'.join(msg)))
     return mark, msg
 
-def create_commit(n, release, releases, mark, reference, graphs):
+def create_commit(n, release, releases, mark, reference, graphs, blob_store):
     logger.info("Creating commit for %s" %(n))
     object_lookup = {}
     # Find n in release
@@ -132,7 +143,7 @@ def create_commit(n, release, releases, mark, reference, graphs):
         objects = reduce_objects_for_commit(objects)
         for o in objects:
             if not o.get_type() == 'dir':
-                mark = create_blob(o, get_mark(mark), release)
+                mark = create_blob(o, get_mark(mark), blob_store)
                 object_lookup[o.get_object_name()] = mark
 
 
@@ -146,7 +157,7 @@ def create_commit(n, release, releases, mark, reference, graphs):
         logger.info("Single Object: %s" %(n))
         o = get_object(n, releases[release]['objects'])
         if not o.get_type() == 'dir':
-            mark = create_blob(o, get_mark(mark), release)
+            mark = create_blob(o, get_mark(mark), blob_store)
             object_lookup[o.get_object_name()] = mark
 
         file_list = create_file_list([o], object_lookup)
@@ -291,16 +302,15 @@ def get_object(o, objects):
         if obj.get_object_name() == o:
             return obj
 
-def create_blob(obj, mark, release):
+def create_blob(obj, mark, blob_store):
     blob =['blob']
     blob.append('mark :'+str(mark))
-    fname = 'data/' + release + '/' + obj.get_object_name()
-    #f = open(fname, 'rb')
-    #content = f.read()
-    #f.close()
-    #length = len(content)
-    #blob.append('data '+ str(length))
-    #blob.append(content)
+    content = blob_store.get(obj.get_object_name())
+    if content is None:
+        logger.warning("No content stored for %s" %(obj.get_object_name()))
+        content = ''
+    blob.append('data '+ str(len(content)))
+    blob.append(content)
     print '\n'.join(blob)
     return mark
 
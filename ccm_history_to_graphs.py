@@ -17,7 +17,9 @@ from pygraphviz import *
 from pygraph.classes.digraph import digraph
 from pygraph.classes.hypergraph import hypergraph
 
-def create_graphs_from_releases(releases):
+def create_graphs_from_releases(releases, draw=True):
+    """Yield (release, {'commit': ..., 'task': ..., 'object': ..., 'release': ...}) for the releases after
+    the initial one, walking by 'next', so only the graphs of the release being used are in memory"""
     # Find first release i.e. where previous is none
     for k, v in releases.iteritems():
         if v['previous'] is None:
@@ -26,28 +28,26 @@ def create_graphs_from_releases(releases):
     #print release, "is initial release, skipping graphing"
     release = releases[release]['next']
 
-    graphs = {}
     while release:
         #print "Creating graph for", release
-        graphs[release] = {}
+        graphs = {}
         object_graph, task_graph, release_graph, commit_graph = create_graphs(releases[release])
-        graphs[release]['commit'] = commit_graph
-        graphs[release]['task'] = task_graph
-        graphs[release]['object'] = object_graph
-        graphs[release]['release'] = release_graph
+        graphs['commit'] = commit_graph
+        graphs['task'] = task_graph
+        graphs['object'] = object_graph
+        graphs['release'] = release_graph
 
         #draw graphs:
-        object_graph_to_image(object_graph, releases[release])
-        task_graph_to_image(object_graph, task_graph, releases[release])
-        release_graph_to_image(object_graph, release_graph, releases[release])
-        commit_graph_to_image(commit_graph, releases[release], task_graph)
+        if draw:
+            object_graph_to_image(object_graph, releases[release])
+            task_graph_to_image(object_graph, task_graph, releases[release])
+            release_graph_to_image(object_graph, release_graph, releases[release])
+            commit_graph_to_image(commit_graph, releases[release], task_graph)
+        yield release, graphs
         #next release
         release = releases[release]['next']
 
 
-    return graphs
-
-
 def find_objects_without_associated_tasks(objects, tasks):
     objects_from_tasks = []
     # compare objects in the tasks with objects in release, to see if there is any single objects
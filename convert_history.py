@@ -7,16 +7,21 @@ Created by Emanuele Zattin on 2011-01-26.
 Copyright (c) 2011 Nokia. All rights reserved.
 """
 
-from itertools import product
 from itertools import permutations
-from itertools import combinations
 from itertools import count
 from pygraph.classes.digraph import digraph
 from pygraph.classes.hypergraph import hypergraph
-from pygraph.algorithms.cycles import find_cycle
-from pygraph.algorithms.critical import transitive_edges
 from pygraph.algorithms.accessibility import mutual_accessibility
+import time
 import logging as log
+from graph_algorithms import cyclic_components, find_cycle_in_component, break_cycles, in_one_component, transitive_reduction
+from graph_algorithms import minimum_cut, topological_order
+
+# Seconds the minimum cut search may take for one edge of a cycle before the objects of the
+# task are split in file history order instead
+cut_time_budget = 10.0
+# Tasks of at most this many objects get all their cuts tried, 0 never does it
+brute_force_cut_limit = 0
 
 def main():
     """A test method"""
@@ -95,22 +100,11 @@ def convert_history(files, tasks, releases, fileobjects):
     """Converts the Synergy history between two releases to a Git compatible one."""
 
     #print "Look for cycles in the File History graph"
-    while find_cycle(files):
-        cycle = find_cycle(files)
-        #print "A cycle was found!"
-        #print "Cycle:", cycle
-
-        # Find the newest file
-        newest = max(cycle, key=lambda x: [fileobject.get_integrate_time() for fileobject in fileobjects if fileobject.get_objectname == x][0])
-        #print "Object %s is the newest in the cycle: it should not have successors!" % newest
-
-        # Remove the outgoing link from the newest file
-        for successor in files.neighbors(newest):
-            if successor in cycle:
-                files.del_edge((newest, successor))
-                #print "Removed the %s -> %s edge" % (newest, successor)
+    # The newest file in a cycle should not have successors: remove its outgoing links in the cycle
+    integrate_times = dict([(fileobject.get_object_name(), fileobject.get_integrate_time()) for fileobject in fileobjects or []])
+    break_cycles(files, key=lambda x: integrate_times.get(x))
 
-    [files.del_edge(edge) for i, edge in transitive_edges(files)]
+    transitive_reduction(files)
     #print "Removed transitive edges from the File History graph."
 
     sanitized_tasks = _sanitize_tasks(tasks)
@@ -120,9 +114,11 @@ def convert_history(files, tasks, releases, fileobjects):
 
     #print "First commits graph created."
 
-    # Cycles detection
-    while find_cycle(commits):
-        cycle = find_cycle(commits)
+    # Cycles detection, every cyclic component is resolved on its own
+    todo = cyclic_components(commits)
+    while todo:
+        component = todo.pop()
+        cycle = find_cycle_in_component(commits, component)
         #print "Cycles found!"
         #print "Cycle:", cycle
 
@@ -141,9 +137,7 @@ def convert_history(files, tasks, releases, fileobjects):
             if tasks.links(node1) == tasks.links(node2):
                 task = tasks.links(node1)[0]
                 # Find which cuts are compatible and add them to the candidates list
-                candidate_cuts.extend( [cut for cut in _find_cuts(tasks.links(task))
-                        if (node1 in cut and node2 not in cut)
-                        or (node2 in cut and node2 not in cut)])
+                candidate_cuts.extend(_find_cuts(tasks.links(task), reduced_graph, files, tasks, node1, node2))
 
         #print "Candidate_cuts:", candidate_cuts
 
@@ -171,8 +165,9 @@ def convert_history(files, tasks, releases, fileobjects):
             # If no more cycles are found in the updated reduced graph then break
             commits2 = create_commits_graph(files, tasks, releases)
 
-            cycle2 = find_cycle(commits2)
-            if set(cycle) & set(cycle2) == set(cycle):
+            # only the component of the cycle and the new task can have changed
+            affected = list(component) + [task_name]
+            if in_one_component(commits2, cycle, affected):
                 # Undo the changes!
                 #print "The cycle was not removed. Undoing changes..."
                 #print "\tDeleting task", task_name
@@ -184,11 +179,12 @@ def convert_history(files, tasks, releases, fileobjects):
                 #print "Done."
             else:
                 #print "Cut found."
-                commits = create_commits_graph(files, tasks, releases)
+                commits = commits2
+                todo.extend(cyclic_components(commits, affected))
                 break
-        #else:
+        else:
             # Error! This should not happen
-            #print "Cut not found."
+            log.warning("No cut found for the cycle %s" % (cycle,))
 
     #else:
         #print "No cycles found"
@@ -197,22 +193,72 @@ def convert_history(files, tasks, releases, fileobjects):
 
 
 def _sanitize_tasks(tasks):
-    common_objects = [(t1, t2, set(tasks.links(t1)) & set(tasks.links(t2)))
-                      for (t1, t2) in combinations(tasks.edges(), 2)
-                      if set(tasks.links(t1)) & set(tasks.links(t2))]
-
-    for (t1, t2, common_objs) in common_objects:
-        for obj in common_objs:
-            tasks.unlink(obj, t1)
-            tasks.unlink(obj, t2)
-
-            task_name = '-'.join(['common', t1, t2])
+    """Move every object shared by tasks to its own 'common-<t1>-<t2>' task"""
+    # the tasks sharing objects, in the order of the edges, and the objects they share
+    position = dict([(task, i) for i, task in enumerate(tasks.edges())])
+    common_objects = {}
+    for obj in tasks.nodes():
+        shared = tasks.links(obj)
+        if len(shared) > 1:
+            common_objects.setdefault(tuple(sorted(shared, key=position.get)), set()).add(obj)
+
+    for shared in sorted(common_objects, key=lambda shared: [position[t] for t in shared]):
+        for obj in common_objects[shared]:
+            for task in shared:
+                tasks.unlink(obj, task)
+
+            task_name = '-'.join(('common',) + shared)
             tasks.add_edge(task_name)
             tasks.link(obj, task_name)
 
     return tasks
 
-def _find_cuts(s):
+def _find_cuts(objects, reduced, files, tasks, node1, node2):
+    """Cuts of the objects of a task which separate node1 and node2, the most promising first.
+
+    First the minimum cuts of the reduced graph from node1 to node2 and back, where only file
+    history edges may be cut and the other tasks stay whole, then the splits of the objects in
+    file history order. The minimum cuts are skipped when they take longer than cut_time_budget"""
+    if len(objects) <= brute_force_cut_limit:
+        return [cut for cut in _all_cuts(objects) if (node1 in cut) != (node2 in cut)]
+
+    task = tasks.links(node1)[0]
+    def capacity(edge):
+        if files.has_edge(edge):
+            return 1
+        if tasks.links(edge[0])[0] == task:
+            # the task itself is what is being cut
+            return 0
+        return None
+
+    cuts = []
+    seen = set()
+    deadline = time.time() + cut_time_budget
+    for source, sink in [(node1, node2), (node2, node1)]:
+        result = minimum_cut(reduced, source, sink, capacity, deadline)
+        if result is None:
+            log.warning("Minimum cut of task %s between %s and %s took more than %.1f s, splitting it in file history order"
+                        % (task, node1, node2, cut_time_budget))
+            break
+        _add_cut(cuts, seen, objects, [o for o in objects if o in result[1]])
+
+    order = topological_order(files, objects) or list(objects)
+    first, last = sorted([order.index(node1), order.index(node2)])
+    for i in range(first + 1, last + 1):
+        _add_cut(cuts, seen, objects, order[:i])
+    return cuts
+
+def _add_cut(cuts, seen, objects, cut):
+    """Add cut unless it or its complement is there already"""
+    if not cut or len(cut) == len(objects):
+        return
+    key = frozenset(cut)
+    if key in seen or frozenset(objects) - key in seen:
+        return
+    seen.add(key)
+    cuts.append(cut)
+
+def _all_cuts(s):
     subsets = reduce(lambda z, x: z + [y + [x] for y in z], s, [[]])[1:-1]
     cuts = []
     [cuts.append(i) for i in subsets if _complementary_set(s, i) not in cuts]
@@ -234,34 +280,53 @@ def create_commits_graph(files, tasks, releases):
     #print "\t\tFrom the releases"
     [commits.add_node(release) for release in releases.edges()]
 
-    # Create the edges from the tasks to the releases
+    # The releases of every object and the position of the releases and tasks, so the edges
+    # are added in the same order as when all (release, task) pairs were walked
+    object_releases = {}
+    for release in releases.edges():
+        for obj in releases.links(release):
+            object_releases.setdefault(obj, []).append(release)
+    position = dict([(node, i) for i, node in enumerate(releases.edges())])
+    position.update([(node, i) for i, node in enumerate(tasks.edges())])
+    pair_order = lambda (release, task): (position[release], position[task])
+
+    # Create the edges from the tasks to the releases: the task has an object of the release
     #print "\tCreate the nodes..."
     #print "\t\tFrom tasks to releases"
-    [commits.add_edge((task, release)) for (release, task) in product(releases.edges(), tasks.edges()) if set(releases.links(release)) & set(tasks.links(task))]
+    task_to_release = set()
+    for obj, object_release_list in object_releases.iteritems():
+        if tasks.has_node(obj):
+            for release in object_release_list:
+                for task in tasks.links(obj):
+                    task_to_release.add((release, task))
+    [commits.add_edge((task, release)) for (release, task) in sorted(task_to_release, key=pair_order)]
+
+    # One pass over the file history edges for the edges from releases to tasks, where an
+    # object of the release is a predecessor of an object of the task, and from tasks to tasks
+    release_to_task = set()
+    task_to_task = []
+    for obj1 in files.nodes():
+        for obj2 in files.neighbors(obj1):
+            for release in object_releases.get(obj1, []):
+                for task in tasks.links(obj2):
+                    release_to_task.add((release, task))
+            if not tasks.has_node(obj1):
+                # obj1 is the node belonging to the previous release
+                continue
+            task_to_task.append((tasks.links(obj1)[0], tasks.links(obj2)[0]))
 
-    # Create the edges from the releases to the tasks
     #print "\t\tFrom releases to tasks"
-    product_number = len(releases.edges()) * len(tasks.edges())
-    for (counter, (release, task)) in enumerate(product(releases.edges(), tasks.edges())):
-        log.info("Edge (%d/%d) from release %s to task %s" % (counter, product_number, release, task))
-        [commits.add_edge((release, task))
-         for obj_in_release
-         in releases.links(release)
-         if set(files.neighbors(obj_in_release)) & set(tasks.links(task))
-         and not commits.has_edge((release, task))]
-
-    # Create the edges from tasks to tasks and from releases to tasks
+    [commits.add_edge((release, task)) for (release, task) in sorted(release_to_task, key=pair_order)]
+
     #print "\t\tFrom tasks to tasks"
-    for (counter, obj1) in enumerate(files.nodes()):
-        log.info("From task to task: object %d/%d" % (counter, len(files.nodes())))
-        if not tasks.has_node(obj1):
-            # obj1 is the node belonging to the previous release
-            continue
-        task1 = tasks.links(obj1)[0]
-        for obj2 in files.neighbors(obj1):
-            task2 = tasks.links(obj2)[0]
-            if not task1 == task2 and not commits.has_edge((task1, task2)):
-                commits.add_edge((task1, task2))
+    num_of_task_edges = 0
+    for task1, task2 in task_to_task:
+        if not task1 == task2 and not commits.has_edge((task1, task2)):
+            commits.add_edge((task1, task2))
+            num_of_task_edges += 1
+
+    log.info("Commits graph: %d tasks, %d releases, %d edges from tasks to releases, %d from releases to tasks, %d from tasks to tasks"
+             % (len(tasks.edges()), len(releases.edges()), len(task_to_release), len(release_to_task), num_of_task_edges))
 
     return commits
 
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+fake_ccm.py
+
+A stand-in for the ccm executable, answering from a corpus recorded with SynergyReplay.
+
+Usage: CCM_REPLAY=<corpus> [CCM_REPLAY_LATENCY=<seconds>] fake_ccm.py <ccm arguments>
+Without arguments it behaves as the interactive ccm command interpreter used by SynergyShell.
+
+Copyright (c) 2011 Nokia. All rights reserved.
+"""
+
+import os
+import sys
+import time
+import shlex
+
+from SynergyReplay import Corpus
+
+def answer(corpus, latency, args):
+    if latency:
+        time.sleep(latency)
+    result = corpus.lookup(['ccm'] + args)
+    if result is None:
+        return '', 'No recorded answer for the Synergy command: %s\n' % (args,)
+    return result
+
+def interactive(corpus, latency):
+    while True:
+        sys.stdout.write('ccm> ')
+        sys.stdout.flush()
+        line = sys.stdin.readline()
+        if not line or line.strip() == 'exit':
+            break
+        args = shlex.split(line)
+        if not args:
+            continue
+        if args[0] == 'echo':
+            sys.stdout.write(' '.join(args[1:]) + '\n')
+        else:
+            stdout, stderr = answer(corpus, latency, args)
+            sys.stdout.write(stdout)
+            sys.stderr.write(stderr)
+            sys.stderr.flush()
+        sys.stdout.flush()
+
+def main():
+    if 'CCM_REPLAY' not in os.environ:
+        sys.stderr.write('fake_ccm.py: set CCM_REPLAY to the corpus to replay\n')
+        sys.exit(1)
+    corpus = Corpus(os.environ['CCM_REPLAY'])
+    latency = float(os.environ.get('CCM_REPLAY_LATENCY', '0'))
+
+    if len(sys.argv) == 1:
+        interactive(corpus, latency)
+        return
+
+    stdout, stderr = answer(corpus, latency, sys.argv[1:])
+    sys.stdout.write(stdout)
+    sys.stderr.write(stderr)
+    if stderr:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,10 +11,12 @@ Copyright (c) 2011 Nokia. All rights reserved.
 
 from datetime import datetime
 import time
-import cPickle
 import os.path
 import os
 import sys
+import cPickle
+import tempfile
+from Queue import Queue
 
 import SynergySession
 import SynergySessions
@@ -22,9 +24,34 @@ import FileObject
 import TaskObject
 import SynergyObject
 from SynergyUtils import ObjectHistory, TaskUtil, SynergyUtils, ObjectHistoryPool
+from VersionGraph import VersionGraph
+from ProjectPathIndex import ProjectPathIndex
+from ProjectLineage import ProjectLineage
+from ReleaseMembershipIndex import ReleaseMembershipIndex
+from BlobStore import BlobStore
+from HistoryJournal import HistoryJournal
+from HistoryStore import HistoryStore
+from SynergyMetrics import MetricsRegistry
+from SynergyReplay import backend_from_environment
+from SynergyCache import cache_from_environment
 
 from operator import itemgetter, attrgetter
 
+class RowSpool(object):
+    """Rows kept in a temporary file, to be read again without holding them in memory"""
+    def __init__(self):
+        self.f = tempfile.TemporaryFile()
+        self.count = 0
+    def add(self, row):
+        cPickle.dump(row, self.f, cPickle.HIGHEST_PROTOCOL)
+        self.count += 1
+    def __iter__(self):
+        self.f.seek(0)
+        for i in xrange(self.count):
+            yield cPickle.load(self.f)
+    def close(self):
+        self.f.close()
+
 class Timer():
     def __init__(self):
         self.time = []
@@ -42,7 +69,7 @@ class Timer():
 class CCMHistory(object):
     """Get History (objects and tasks) in a Synergy (ccm) database between baseline projects"""
 
-    def __init__(self, ccm, ccmpool, history, outputfile):
+    def __init__(self, ccm, ccmpool, history, outputfile, blob_store=None, resume=False, store=None):
         self.ccm = ccm
         self.ccmpool = ccmpool
         self.delim = self.ccm.delim()
@@ -51,6 +78,21 @@ class CCMHistory(object):
         self.tag = ""
         self.outputfile = outputfile
         self.timer = Timer()
+        # paths of the members of the releases being compared, shared by the whole pool
+        self.path_index = ProjectPathIndex()
+        # baselines of the released projects, kept between runs
+        self.project_lineage = ProjectLineage.load(self.outputfile + '_lineage.p')
+        # subprojects and released object versions of the releases being compared
+        self.membership_index = ReleaseMembershipIndex()
+        # file contents of all releases
+        self.blob_store = blob_store or BlobStore(self.outputfile + '_blobs')
+        # the history of the releases done, written record by record
+        self.store = store or HistoryStore(self.outputfile)
+        # objects and tasks done so far, replayed to skip them when resuming a run which died
+        self.journal = HistoryJournal(self.outputfile + '_journal', resume)
+        self.resumed = self.journal.replay() if resume else {}
+        for tag, release in self.resumed.iteritems():
+            print "resuming", tag, "with", len(release['objects']), "objects and", len(release['tasks']), "tasks done", "(release done)" if release['done'] else ""
 
     def get_project_history(self, project):
         # find latest top-level project
@@ -67,9 +109,9 @@ class CCMHistory(object):
         print "Latest project:", latestproject.get_object_name(), "created:", latest
 
         #find baseline of latestproject:
-        base = self.ccm.query("is_baseline_project_of('{0}')".format(latestproject.get_object_name())).format("%objectname").format("%create_time").format('%version').format("%owner").format("%status").format("%task").run()[0]
-        baseline_project = SynergyObject.SynergyObject(base['objectname'], self.delim, base['owner'], base['status'], base['create_time'], base['task'])
-        print "Baseline project:", baseline_project.get_object_name()
+        baseline_project = self.find_baseline_project(latestproject)
+        if baseline_project:
+            print "Baseline project:", baseline_project.get_object_name()
         if self.tag not in self.history.keys():
             self.history[self.tag] = {'objects': [], 'tasks': []}
         self.history[self.tag]['next'] = None
@@ -77,27 +119,25 @@ class CCMHistory(object):
         while baseline_project:
             print "Toplevel Project:", latestproject.get_object_name()
             # do the history thing
-            self.create_history(latestproject.get_object_name(), baseline_project.get_object_name())
+            if not self.restore_release():
+                self.create_history(latestproject.get_object_name(), baseline_project.get_object_name())
+                self.journal.release_done(self.tag)
             self.history[self.tag]['created'] = latestproject.get_created_time()
+            self.history[self.tag]['author'] = latestproject.get_author()
 
             next = latestproject.get_version()
 
             # Find next baseline project
             latestproject = baseline_project
-            baseline = self.ccm.query("is_baseline_project_of('{0}')".format(latestproject.get_object_name())).format("%objectname").format("%create_time").format('%version').format("%owner").format("%status").format("%task").run()[0]
-            baseline_project = SynergyObject.SynergyObject(baseline['objectname'], self.delim, baseline['owner'], baseline['status'], baseline['create_time'], baseline['task'])
+            baseline_project = self.find_baseline_project(latestproject)
 
             #Set previous project and name of current release:
             self.history[self.tag]['previous'] = latestproject.get_version()
             self.history[self.tag]['name'] = self.tag
 
             #Store data
-            fname = self.outputfile + '_' + self.tag
-            self.persist_data(fname, self.history[self.tag])
-            self.history_created.append(fname)
-            # delete the _inc file if it exists
-            if os.path.isfile(fname + '_inc' + '.p'):
-                os.remove(fname + '_inc' + '.p')
+            self.store.put_release(self.tag, self.history[self.tag])
+            self.history_created.append(self.tag)
 
             #Print Info
             print self.tag, "done processing, Info:"
@@ -118,16 +158,22 @@ class CCMHistory(object):
                 self.history[self.tag] = {'objects': [], 'tasks': []}
             self.history[self.tag]['next'] = next
 
-            print "baseline project version:", baseline_project.get_version()
+            if baseline_project:
+                print "baseline project version:", baseline_project.get_version()
 
         self.history[self.tag]['previous'] = None
         print "getting all objects for:", latestproject.get_version(), "..."
         # Do the last project as a full project
-        self.find_project_diff(latestproject.get_object_name(), baseline_project, latestproject.get_object_name())
+        if not self.restore_release():
+            self.find_project_diff(latestproject.get_object_name(), baseline_project, latestproject.get_object_name())
+            self.journal.release_done(self.tag)
         self.history[self.tag]['name'] = self.tag
         self.history[self.tag]['created'] = latestproject.get_created_time()
+        self.history[self.tag]['author'] = latestproject.get_author()
         #Print Info
         self.history[self.tag]['previous'] = None
+        self.store.put_release(self.tag, self.history[self.tag])
+        self.history_created.append(self.tag)
         print self.tag, "done processing, Info:"
         print "Name        ", self.tag
         print "Previous <- ", self.history[self.tag]['previous']
@@ -140,6 +186,23 @@ class CCMHistory(object):
         return self.history
 
 
+    def restore_release(self):
+        """Take the objects and tasks of the current release from the journal if it was done before resuming"""
+        if not (self.tag in self.resumed and self.resumed[self.tag]['done']):
+            return False
+        print "release done before resuming:", self.tag
+        self.history[self.tag]['objects'] = self.resumed[self.tag]['objects'].values()
+        self.history[self.tag]['tasks'] = [t for t in self.resumed[self.tag]['tasks'].values() if t]
+        return True
+
+    def find_baseline_project(self, project):
+        """The baseline project of project, None for the first release"""
+        result = self.ccm.query("is_baseline_project_of('{0}')".format(project.get_object_name())).format("%objectname").format("%create_time").format('%version').format("%owner").format("%status").format("%task").run()
+        if not result:
+            return None
+        base = result[0]
+        return SynergyObject.SynergyObject(base['objectname'], self.delim, base['owner'], base['status'], base['create_time'], base['task'])
+
     def create_history(self, latestproject, baseline_project):
         #clear changed objects and find all objects from this release
         self.find_project_diff(latestproject, baseline_project, latestproject)
@@ -147,25 +210,43 @@ class CCMHistory(object):
     def find_project_diff(self, latestproject, baseline_project, toplevel_project):
         # Find difference between latestproject and baseline_project
         if baseline_project:
-            object_hist_pool = ObjectHistoryPool(self.ccmpool, toplevel_project, baseline_project)
-            objects_changed = self.ccm.query("recursive_is_member_of('{0}', 'none') and not recursive_is_member_of('{1}', 'none')".format(latestproject, baseline_project)).format("%objectname").format("%owner").format("%status").format("%create_time").format("%task").run()
+            old_release = baseline_project
+            objects_changed = self.ccm.query("recursive_is_member_of('{0}', 'none') and not recursive_is_member_of('{1}', 'none')".format(latestproject, baseline_project)).format("%objectname").format("%owner").format("%status").format("%create_time").format("%task").run_iter()
         else:
             # root project, get ALL objects in release
-            object_hist_pool = ObjectHistoryPool(self.ccmpool, toplevel_project, toplevel_project)
-            objects_changed = self.ccm.query("recursive_is_member_of('{0}', 'none')".format(latestproject)).format("%objectname").format("%owner").format("%status").format("%create_time").format("%task").run()
-
-        print "DEBUG: instantiated an object_hist_pool, type is: " + str(type(object_hist_pool))
-        print "DEBUG: object_hist_pool[0]'s type is: " + str(type(object_hist_pool[0]))
-
-        # make the objects_changed dictionary into an array, to be able to walk it by index
-        objects_changed_indexable = []
+            old_release = toplevel_project
+            objects_changed = self.ccm.query("recursive_is_member_of('{0}', 'none')".format(latestproject)).format("%objectname").format("%owner").format("%status").format("%create_time").format("%task").run_iter()
+        resumed = self.resumed[self.tag]['objects'] if self.tag in self.resumed else {}
+        # the rows go to a spool file before any other command runs on the session, since ccm
+        # would block on a streamed result which is not read while the next command waits for it
+        spool = RowSpool()
+        already_done = 0
         for o in objects_changed:
-            objects_changed_indexable.append(o)
-
-        num_of_objects = len([o for o in objects_changed if ":project:" not in o])
+            if ':project:' in o['objectname']:
+                continue
+            spool.add(o)
+            if o['objectname'] in resumed:
+                already_done += 1
+
+        # Get the version trees of the objects up front, so their history is walked in memory.
+        # For the root project only the predecessors of directories are needed
+        version_graph = VersionGraph()
+        version_graph.extract(self.ccm, (o['objectname'] for o in spool if baseline_project or ':dir:' in o['objectname']))
+        print "version trees loaded with", version_graph.num_of_cmds, "history commands"
+        # the old release is the current one of the next round, so its paths are kept
+        self.path_index.retain([toplevel_project, old_release])
+        self.membership_index.retain([toplevel_project, old_release])
+        for release in [toplevel_project, old_release]:
+            self.path_index.build(self.ccm, release)
+            self.membership_index.build(self.ccm, release)
+        print "project paths indexed with", self.path_index.num_of_cmds, "is_child_of queries so far"
+        self.project_lineage.prepare(self.ccm, self.membership_index.get_subprojects(toplevel_project) | self.membership_index.get_subprojects(old_release))
+        self.project_lineage.save(self.outputfile + '_lineage.p')
+        object_hist_pool = ObjectHistoryPool(self.ccmpool, toplevel_project, old_release, version_graph, self.path_index, self.project_lineage, self.membership_index, self.blob_store)
+
+        num_of_objects = spool.count - already_done
         print "objects to process for",  latestproject, ": ", num_of_objects
         objects = {}
-        persist = 1
         if self.tag in self.history.keys():
             if 'objects' in self.history[self.tag]:
                 #Add all existin objects
@@ -173,75 +254,46 @@ class CCMHistory(object):
                     objects[o.get_object_name()] = o
         else:
             self.history[self.tag] = {'objects': [], 'tasks': []}
-
-        # Check history for all objects and add them to history
-        objects_changed_processing_progress_idx = 0
-        while True: # this is the objects_changed progress outer loop, which is broken when the last object in objects_changed has been processed in a processing pool
-            # build the processing pool
-            current_pool_fill_idx = 0
-            current_pool_ObjectArray = []
-            print "DEBUG: Populate a processing pool..."
-            while True:
-                tempobject = objects_changed_indexable[objects_changed_processing_progress_idx]
-                print "DEBUG: -  start checking: tempobject['objectname'] = " + str(tempobject['objectname']) + " for pool inclusion"
-                if tempobject['objectname'] not in objects.keys(): 
-                    print "DEBUG: --  tempobject['objectname'] = " + str(tempobject['objectname']) + " not already in objects.keys()"
-                    if ':project:' not in tempobject['objectname']:
-                        print "DEBUG: ---  ':project:' not in tempobject['objectname'] = " + str(tempobject['objectname'])
-                        print "DEBUG:      objects_changed_indexable[objects_changed_processing_progress_idx] type = " + str(type(objects_changed_indexable[objects_changed_processing_progress_idx]))
-                        current_pool_ObjectArray.append(objects_changed_indexable[objects_changed_processing_progress_idx])
-                        print "DEBUG: current_pool_fill_idx = " + str(current_pool_fill_idx)                       
-                        print "DEBUG: ----  current_pool_ObjectArray[" + str(current_pool_fill_idx) + "] = " + str(current_pool_ObjectArray[current_pool_fill_idx])
-                        if (current_pool_fill_idx >= self.ccmpool.nr_sessions-1):
-                            break
-                        current_pool_fill_idx += 1
-                if (objects_changed_processing_progress_idx >= len(objects_changed_indexable)-1):
+        objects.update(resumed)
+
+        # Check history for all objects and add them to history. Idle sessions pick up the next
+        # object as soon as they are done, and at most two objects per session are queued so
+        # objects found as predecessors in the meantime are not processed twice
+        get_history = lambda session, fileobject: object_hist_pool[session.getSessionID()].get_history(fileobject)
+        window = 2 * self.ccmpool.nr_sessions
+        todo = iter(spool)
+        submitted = set()
+        outstanding = set()
+        # the futures are put here as they finish
+        done = Queue()
+        while True:
+            while len(outstanding) < window:
+                o = next(todo, None)
+                if o is None:
                     break
-                objects_changed_processing_progress_idx += 1
-    
-            print "DEBUG: start processing pool"
-            ccm_session_idx = 0
-            print "DEBUG: type(object_hist_pool) = " + str(type(object_hist_pool))
-            print "DEBUG: type(ccm_session_idx) = " + str(type(ccm_session_idx))
-            for workobject in current_pool_ObjectArray:
-                print "DEBUG: type(workobject) = " + str(type(workobject))
-                # now we have a processing pool, of finite size, kick off the pool
-                print "DEBUG: +  object_hist_pool[" + str(ccm_session_idx) + "].start_get_history("
-                object_hist_pool[ccm_session_idx].start_get_history(FileObject.FileObject(workobject['objectname'], self.delim, workobject['owner'], workobject['status'], workobject['create_time'], workobject['task']))
-                ccm_session_idx += 1
-
-            # join the processing pool
-            current_pool_ReturnObjectsArray = []
-            with self.timer:
-                ccm_session_idx = 0
-                for workobject in current_pool_ObjectArray:
-                    print "DEBUG: Waiting for object_hist_pool[" + str(ccm_session_idx) + "]"
-                    current_pool_ReturnObjectsArray.append(object_hist_pool[ccm_session_idx].join_get_history())
-                    ccm_session_idx += 1
-            
-            # update the objects not already in the objects array (in case the same object is effectively processed multiple times in the same pool)
-            for retObject in current_pool_ReturnObjectsArray:
-                print "retObject = " + str(retObject)
-                print "retObject type = " + str(type(retObject))
-                if (retObject not in objects.keys()):
-                    objects.update(retObject)
-
-            # break out of the pool processing loop if all elemenets have been processed
-            if (objects_changed_processing_progress_idx >= len(objects_changed_indexable)-1):
+                if o['objectname'] in objects or o['objectname'] in submitted:
+                    continue
+                submitted.add(o['objectname'])
+                fileobject = FileObject.FileObject(o['objectname'], self.delim, o['owner'], o['status'], o['create_time'], o['task'])
+                outstanding.add(self.ccmpool.submit(get_history, fileobject, done=done))
+            if not outstanding:
                 break
 
-            persist += len(current_pool_ReturnObjectsArray)
-
-            if persist % 100 == 0:
-                self.history[self.tag]['objects'] = objects.values()
-                fname = self.outputfile + '_' + self.tag + '_inc'
-                self.persist_data(fname, self.history[self.tag])
-
-            num_of_objects -= len(current_pool_ObjectArray)
+            with self.timer:
+                future = done.get()
+            outstanding.remove(future)
+            found = dict([(name, fileobject) for name, fileobject in future.result().iteritems() if name not in objects])
+            objects.update(found)
+            if found:
+                self.journal.add_objects(self.tag, found)
+
+            num_of_objects -= 1
             print "objects left:", num_of_objects
-
+        spool.close()
 
         print "number of files:", str(len(objects.values()))
+        print "project path cache:", object_hist_pool.path_cache
+        print "blob store:", self.blob_store
         self.history[self.tag]['objects'] = objects.values()
 
         # Create tasks from objects
@@ -258,61 +310,78 @@ class CCMHistory(object):
                 for t in self.history[self.tag]['tasks']:
                     print "loading old task:", t.get_display_name()
                     tasks[t.get_display_name()] = t
+        # tasks resolved before resuming, None for the ones which are not used
+        resolved = self.resumed.get(self.tag, {'tasks': {}})['tasks']
+        for task, to in resolved.iteritems():
+            if to and task not in tasks:
+                tasks[task] = to
 
         num_of_tasks = sum([len(o.get_tasks().split(',')) for o in objects])
         print "Tasks with associated objects:", num_of_tasks
-        #Find all tasks from the objects found
+        #Find all tasks from the objects found, keeping the order the objects are associated in
+        task_objects = {}
+        new_tasks = []
         for o in objects:
             for task in o.get_tasks().split(','):
                 if task != "<void>":
-                    if task not in tasks.keys():
-                        if task not in not_used:
-                            # create task object
-                            print "Task:", task
-                            if task_util.task_in_project(task, project):
-                                result = self.ccm.query("name='{0}' and instance='{1}'".format('task' + task.split('#')[1], task.split('#')[0])).format("%objectname").format("%owner").format("%status").format("%create_time").format("%task_synopsis").format("%release").run()
-
-                                t = result[0]
-                                # Only use completed tasks!
-                                if t['status'] == 'completed':
-                                    to = TaskObject.TaskObject(t['objectname'], self.delim, t['owner'], t['status'], t['create_time'], task)
-                                    to.set_synopsis(t['task_synopsis'])
-                                    to.set_release(t['release'])
-                                    print "adding", o.get_object_name(), "to", task
-                                    to.add_object(o.get_object_name())
-
-                                    tasks[task] = to
-                            else:
-                                not_used.append(task)
-                    else:
-                        if o.get_object_name() not in tasks[task].get_objects():
-                            print "adding", o.get_object_name(), "to", task
-                            tasks[task].add_object(o.get_object_name())
+                    if task not in task_objects:
+                        task_objects[task] = []
+                        if task not in tasks and task not in resolved:
+                            new_tasks.append(task)
+                    if o.get_object_name() not in task_objects[task]:
+                        task_objects[task].append(o.get_object_name())
+
+        num_of_tasks = len(new_tasks)
+        candidates = []
+        for task in new_tasks:
+            print "Task:", task
+            if task_util.task_in_project(task, project):
+                candidates.append(task)
+            else:
+                not_used.append(task)
+                self.journal.add_task(self.tag, task, None)
             num_of_tasks -= 1
             print "tasks left:", num_of_tasks
 
+        # Look up all the task objects at once
+        task_token = lambda task: ('task' + task.split('#')[1], task.split('#')[0])
+        results = self.ccm.query_many(candidates, lambda task: "name='{0}' and instance='{1}'".format(*task_token(task)),
+                                      format=["%owner", "%status", "%create_time", "%task_synopsis", "%release", "%name", "%instance"],
+                                      key_token=task_token,
+                                      row_token=lambda row: (row['name'], row['instance']))
+        for task in candidates:
+            t = results[task][0]
+            # Only use completed tasks!
+            if t['status'] == 'completed':
+                to = TaskObject.TaskObject(t['objectname'], self.delim, t['owner'], t['status'], t['create_time'], task)
+                to.set_synopsis(t['task_synopsis'])
+                to.set_release(t['release'])
+                tasks[task] = to
+            else:
+                self.journal.add_task(self.tag, task, None)
+
+        for task, object_names in task_objects.iteritems():
+            if task in tasks:
+                for o in object_names:
+                    if tasks[task].get_objects() is None or o not in tasks[task].get_objects():
+                        print "adding", o, "to", task
+                        tasks[task].add_object(o)
+
         num_of_tasks = len(tasks.keys())
         print "Tasks in release to process for info:", num_of_tasks
 
-        # Fill out all task info
+        # Fill out all task info, with the attributes of all tasks fetched together
+        todo = [task for task in tasks.values() if not task.get_attributes()]
+        attributes = task_util.synergy_utils.get_attributes(todo, task_util.synergy_utils.attribute_blacklist)
         for task in tasks.values():
             if not task.get_attributes():
-                task_util.fill_task_info(task)
+                task_util.fill_task_info(task, attributes[task.get_object_name()])
+                # only the tasks filled in this run are journaled, the restored ones are there already
+                self.journal.add_task(self.tag, task.get_display_name(), task)
             num_of_tasks -= 1
             print "tasks left:", num_of_tasks
 
         self.history[self.tag]['tasks'] = tasks.values()
-        fname = self.outputfile + '_' + self.tag + '_inc'
-        self.persist_data(fname, self.history[self.tag])
-
-
-    def persist_data(self, fname, data):
-        fname = fname + '.p'
-        print "saving..."
-        fh = open(fname, 'wb')
-        cPickle.dump(data, fh, cPickle.HIGHEST_PROTOCOL)
-        fh.close()
-        print "done..."
 
 
 def main():
@@ -321,27 +390,55 @@ def main():
     outputfile = sys.argv[3]
 
     print "Starting Synergy session on", ccm_db, "..."
-    ccm = SynergySession.SynergySession(ccm_db)
-    ccmpool = SynergySessions.SynergySessions(database=ccm_db, nr_sessions=10)
+    metrics = MetricsRegistry()
+    # CCM_RECORD=<corpus> records all ccm answers, CCM_REPLAY=<corpus> runs offline from a recording
+    backend = backend_from_environment()
+    # CCM_CACHE=<file> keeps the answers of ccm on disk for the next run
+    cache = cache_from_environment()
+    ccm = SynergySession.SynergySession(ccm_db, metrics=metrics, backend=backend, cache=cache)
+    ccmpool = SynergySessions.SynergySessions(database=ccm_db, nr_sessions=10, metrics=metrics, backend=backend, cache=cache)
     print "session started"
     delim = ccm.delim()
     history = {}
+    # the history is kept in outputfile.data, indexed by outputfile.index
+    store = HistoryStore(outputfile)
     fname = outputfile + '.p'
     if os.path.isfile(fname):
-        print "Loading", fname, "..."
-        fh = open(fname, 'rb')
-        history = cPickle.load(fh)
-        fh.close()
+        if store.releases():
+            print "Not importing", fname, "again, the history is in", store.fname
+        else:
+            # the history of a run from before the store, imported once
+            print "Importing", fname, "into", store.fname, "..."
+            fh = open(fname, 'rb')
+            store.import_history(cPickle.load(fh))
+            fh.close()
+    if store.releases():
+        print "Loading", store.fname, "..."
+        history = store.load()
         print "history contains:", history.keys()
 
     #print history
-    fetch_ccm = CCMHistory(ccm, ccmpool, history, outputfile)
+    # CCM_BLOB_DELTAS=1 stores file versions as deltas to each other
+    blob_store = BlobStore(outputfile + '_blobs', deltas=bool(os.environ.get('CCM_BLOB_DELTAS')))
+    # CCM_RESUME=1 continues a run which died from its journal
+    fetch_ccm = CCMHistory(ccm, ccmpool, history, outputfile, blob_store, resume=bool(os.environ.get('CCM_RESUME')), store=store)
     history = fetch_ccm.get_project_history(project)
 
-
-    fh = open(outputfile + '.p', 'wb')
-    cPickle.dump(history, fh, cPickle.HIGHEST_PROTOCOL)
-    fh.close()
+    # releases stored again leave their old records behind
+    if store.garbage() > os.path.getsize(store.fname) / 2:
+        print "Compacting", store.fname, "..."
+        store.compact()
+    store.close()
+    fetch_ccm.journal.close(remove=True)
+
+    print "ccm commands:"
+    print metrics
+    metrics.dump(outputfile + '_metrics.json')
+    metrics.dump(outputfile + '_metrics.prom', 'prometheus')
+    if cache:
+        print "ccm cache:"
+        print cache
+        cache.close()
 
 
 
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+graph_algorithms.py
+
+Graph algorithms for the history graphs, working on pygraph digraphs
+
+Copyright (c) 2011 Nokia. All rights reserved.
+"""
+
+import time
+from collections import deque
+
+def strongly_connected_components(graph, nodes=None):
+    """The strongly connected components of graph, or of the subgraph of nodes, as lists of nodes.
+
+    Tarjan's algorithm with an explicit stack, so deep histories do not hit the recursion limit"""
+    if nodes is None:
+        nodes = graph.nodes()
+    inside = set(nodes)
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    components = []
+    for root in nodes:
+        if root in index:
+            continue
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        # (node, iterator over its successors not yet visited)
+        work = [(root, iter(graph.neighbors(root)))]
+        while work:
+            node, successors = work[-1]
+            for successor in successors:
+                if successor not in inside:
+                    continue
+                if successor not in index:
+                    index[successor] = lowlink[successor] = len(index)
+                    stack.append(successor)
+                    on_stack.add(successor)
+                    work.append((successor, iter(graph.neighbors(successor))))
+                    break
+                elif successor in on_stack:
+                    lowlink[node] = min(lowlink[node], index[successor])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+    return components
+
+def cyclic_components(graph, nodes=None):
+    """The strongly connected components which contain a cycle"""
+    return [c for c in strongly_connected_components(graph, nodes)
+            if len(c) > 1 or c[0] in graph.neighbors(c[0])]
+
+def find_cycle_in_component(graph, component):
+    """A cycle through nodes of a cyclic component, as the list of its nodes.
+
+    Every node of the component has a successor in it, so following successors inside the
+    component reaches a node seen before"""
+    members = set(component)
+    path = [component[0]]
+    position = {component[0]: 0}
+    while True:
+        successor = [n for n in graph.neighbors(path[-1]) if n in members][0]
+        if successor in position:
+            return path[position[successor]:]
+        position[successor] = len(path)
+        path.append(successor)
+
+def break_cycles(graph, key):
+    """Make graph acyclic: in a cycle the node with the largest key loses its edges to the other nodes of the cycle.
+
+    Every cyclic component is resolved on its own and only the component changed is searched
+    for cycles again. Returns the edges removed"""
+    removed = []
+    todo = cyclic_components(graph)
+    while todo:
+        component = todo.pop()
+        cycle = find_cycle_in_component(graph, component)
+        newest = max(cycle, key=key)
+        for successor in list(graph.neighbors(newest)):
+            if successor in cycle:
+                graph.del_edge((newest, successor))
+                removed.append((newest, successor))
+        todo.extend(cyclic_components(graph, component))
+    return removed
+
+def in_one_component(graph, nodes, subgraph):
+    """True if all nodes are in the same strongly connected component of the subgraph of graph"""
+    nodes = set(nodes)
+    for component in strongly_connected_components(graph, subgraph):
+        if nodes & set(component):
+            return nodes <= set(component)
+    return False
+
+def weakly_connected_components(graph):
+    """The components of graph when the direction of the edges is ignored, as lists of nodes"""
+    component_of = {}
+    components = []
+    for root in graph.nodes():
+        if root in component_of:
+            continue
+        component = [root]
+        component_of[root] = component
+        todo = [root]
+        while todo:
+            node = todo.pop()
+            for other in graph.neighbors(node) + graph.incidents(node):
+                if other not in component_of:
+                    component_of[other] = component
+                    component.append(other)
+                    todo.append(other)
+        components.append(component)
+    return components
+
+def topological_order(graph, nodes=None):
+    """The nodes of an acyclic graph, or of the subgraph of nodes, with every node before its successors. None if there is a cycle"""
+    if nodes is None:
+        nodes = graph.nodes()
+    inside = set(nodes)
+    incoming = dict([(n, len([p for p in graph.incidents(n) if p in inside])) for n in nodes])
+    order = [n for n in nodes if not incoming[n]]
+    for node in order:
+        for successor in graph.neighbors(node):
+            if successor in inside:
+                incoming[successor] -= 1
+                if not incoming[successor]:
+                    order.append(successor)
+    if len(order) < len(nodes):
+        return None
+    return order
+
+def transitive_edges(graph):
+    """The edges (u, v) of an acyclic graph for which v can be reached from u without the edge.
+
+    Every weakly connected component, i.e. the version tree of one file, is done on its own:
+    in reverse topological order the nodes reachable from a node are collected in a bitset,
+    taking its successors nearest first, and a successor already in the bitset is reachable
+    through another successor. Returns [] for a graph with a cycle, like pygraph's transitive_edges"""
+    edges = []
+    for component in weakly_connected_components(graph):
+        order = topological_order(graph, component)
+        if order is None:
+            return []
+        position = dict([(n, i) for i, n in enumerate(order)])
+        reachable = {}
+        # a bitset is dropped once all predecessors of its node are done, so long chains keep few of them
+        waiting = dict([(n, len(graph.incidents(n))) for n in order])
+        for node in reversed(order):
+            seen = 0
+            for successor in sorted(graph.neighbors(node), key=position.get):
+                if seen >> position[successor] & 1:
+                    edges.append((node, successor))
+                else:
+                    seen |= reachable[successor] | 1 << position[successor]
+                waiting[successor] -= 1
+                if not waiting[successor]:
+                    del reachable[successor]
+            reachable[node] = seen
+    return edges
+
+def transitive_reduction(graph):
+    """Remove the transitive edges of an acyclic graph, returns the edges removed"""
+    edges = transitive_edges(graph)
+    for edge in edges:
+        graph.del_edge(edge)
+    return edges
+
+def minimum_cut(graph, source, sink, capacity, deadline=None):
+    """A minimum cut between source and sink by Edmonds-Karp max-flow.
+
+    capacity(edge) is the capacity of an edge, or None for an edge which must not be cut.
+    Returns (flow, set of the nodes on the source side), or None if time.time() passes deadline"""
+    residual = dict([(n, {}) for n in graph.nodes()])
+    uncuttable = []
+    finite = 0
+    for u, v in graph.edges():
+        c = capacity((u, v))
+        if c is None:
+            uncuttable.append((u, v))
+            continue
+        residual[u][v] = residual[u].get(v, 0) + c
+        residual[v].setdefault(u, 0)
+        finite += c
+    # more than all cuttable edges together
+    for u, v in uncuttable:
+        residual[u][v] = finite + 1
+        residual[v].setdefault(u, 0)
+
+    def reachable_from_source():
+        parent = {source: None}
+        todo = deque([source])
+        while todo:
+            node = todo.popleft()
+            for successor, c in residual[node].iteritems():
+                if c > 0 and successor not in parent:
+                    parent[successor] = node
+                    todo.append(successor)
+        return parent
+
+    flow = 0
+    while True:
+        if deadline is not None and time.time() > deadline:
+            return None
+        parent = reachable_from_source()
+        if sink not in parent:
+            return flow, set(parent)
+        path = []
+        node = sink
+        while parent[node] is not None:
+            path.append((parent[node], node))
+            node = parent[node]
+        bottleneck = min([residual[u][v] for u, v in path])
+        for u, v in path:
+            residual[u][v] -= bottleneck
+            residual[v][u] += bottleneck
+        flow += bottleneck
@@ -11,16 +11,18 @@ Copyright (c) 2011 Nokia. All rights reserved.
 
 import FileObject
 import TaskObject
-import cPickle
-f = open('s30_hist.p', 'rb')
-history = cPickle.load(f)
+from HistoryStore import LazyHistory
+from BlobStore import BlobStore
+# releases are read from s30_hist.data one at a time, as they are graphed and exported
+history = LazyHistory('s30_hist')
 import CCMHistoryGraph
 import convert_history as ch
 import ccm_history_to_graphs as cg
 import ccm_fast_export as cfe
 
+# every release is graphed as the export reaches it
 cgraphs = cg.create_graphs_from_releases(history)
 
-cfe.ccm_fast_export(history, cgraphs)
+cfe.ccm_fast_export(history, cgraphs, BlobStore('s30_hist_blobs'))
 
 
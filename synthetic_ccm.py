@@ -0,0 +1,489 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+synthetic_ccm.py
+
+A generated Synergy database which answers the ccm commands used by fetch-ccm-history.py.
+
+SyntheticDatabase builds the releases, projects, directories, object versions and tasks.
+SyntheticBackend serves it in process as the backend of a SynergySession; run as a script
+(with SYNTHETIC_CCM_DB pointing at a database saved with SyntheticDatabase.save()) it is a
+stand-in for the ccm executable.
+
+Copyright (c) 2011 Nokia. All rights reserved.
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import cPickle
+from datetime import datetime, timedelta
+
+TIME_FORMAT = "%a %b %d %H:%M:%S %Y"
+
+class SyntheticDatabase(object):
+    """Releases of a product 'prod' with a subproject 'lib', each release based on the previous one"""
+
+    def __init__(self, objects=200, versions=4, tasks=50, releases=4, depth=3, merge_frequency=0.1, attributes=5, seed=0):
+        self.delimiter = '-'
+        self.instance = 'db1'
+        self.rng = random.Random(seed)
+        self.now = datetime.now().replace(microsecond=0)
+
+        # objectname -> attribute dictionary
+        self.objects = {}
+        self.predecessors = {}
+        self.successors = {}
+        # project -> direct members, (dir or project, project) -> children, (object, project) -> path
+        self.members = {}
+        self.children = {}
+        self.paths = {}
+        self.baseline = {}
+        self.task_objects = {}
+        self.contents = {}
+        self.indexes = {}
+        self.extra_attributes = ['attr_%d' % i for i in range(attributes)]
+
+        self.release_times = [self.now - timedelta(days=releases - k, hours=1) for k in range(releases)]
+        self._create_tasks(tasks, releases)
+        self._create_projects(releases)
+        self._create_files(objects, versions, releases, depth, merge_frequency)
+
+    def objectname(self, name, version, type):
+        return name + self.delimiter + version + ':' + type + ':' + self.instance
+
+    def _time_in_release(self, k):
+        start = self.release_times[k - 1] if k else self.release_times[0] - timedelta(days=1)
+        return start + timedelta(seconds=self.rng.randint(60, int((self.release_times[k] - start).total_seconds()) - 60))
+
+    def _add(self, objectname, name, version, type, owner, status, create_time, **attributes):
+        o = {'objectname': objectname, 'name': name, 'version': version, 'type': type, 'instance': self.instance,
+             'owner': owner, 'status': status, 'create_time': create_time.strftime(TIME_FORMAT), 'created': create_time,
+             'task': '<void>', 'comment': '', 'cluster_id': '1', 'modify_time': create_time.strftime(TIME_FORMAT)}
+        o.update(attributes)
+        self.objects[objectname] = o
+        self.predecessors.setdefault(objectname, [])
+        self.successors.setdefault(objectname, [])
+        return o
+
+    def _create_tasks(self, tasks, releases):
+        self.release_tasks = []
+        per_release = max(1, tasks / releases)
+        for k in range(releases):
+            names = []
+            for i in range(k * per_release, (k + 1) * per_release):
+                owner = 'user%d' % (i % 7)
+                created = self._time_in_release(k)
+                completed = created + timedelta(minutes=30)
+                status_log = "%s: Status set to 'task_assigned' by %s in role build_mgr on %s\n%s: Status set to 'completed' by %s in role developer on %s\n" % (
+                    created.strftime(TIME_FORMAT), owner, self.instance, completed.strftime(TIME_FORMAT), owner, self.instance)
+                o = self._add(self.objectname('task%d' % i, '1', 'task'), 'task%d' % i, '1', 'task', owner, 'completed', created,
+                              task_synopsis='Synthetic change %d' % i, task_description='Change %d\nin release r%d' % (i, k + 1),
+                              task_number=str(i), release='prod/r%d' % (k + 1), resolver=owner, status_log=status_log)
+                self.task_objects[o['objectname']] = []
+                names.append(o['objectname'])
+            self.release_tasks.append(names)
+
+    def _create_projects(self, releases):
+        self.top = []
+        self.sub = []
+        for k in range(releases):
+            for name, projects in [('prod', self.top), ('lib', self.sub)]:
+                p = self._add(self.objectname(name, 'r%d' % (k + 1), 'project'), name, 'r%d' % (k + 1), 'project', 'build_mgr', 'released', self.release_times[k])
+                projects.append(p['objectname'])
+                self.members[p['objectname']] = set()
+                if k:
+                    self.baseline[p['objectname']] = projects[k - 1]
+                    p['baseline'] = projects[k - 1]
+            self._add_member(self.sub[k], self.top[k], self.top[k], 'prod/lib')
+
+    def _add_member(self, objectname, parent, project, path):
+        self.members[project].add(objectname)
+        self.children.setdefault((parent, project), []).append(objectname)
+        self.paths[(objectname, project)] = path
+
+    def _task_display_name(self, task):
+        return self.instance + '#' + self.objects[task]['name'][len('task'):]
+
+    def _create_version(self, name, version, type, k, preds):
+        task = self.rng.choice(self.release_tasks[k])
+        owner = self.objects[task]['owner']
+        created = self._time_in_release(k)
+        integrated = created + timedelta(minutes=10)
+        status_log = "%s: Status set to 'working' by %s in role developer\n%s: Status set to 'integrate' by %s in role developer\n" % (
+            created.strftime(TIME_FORMAT), owner, integrated.strftime(TIME_FORMAT), owner)
+        attributes = dict([(a, 'value of %s for %s' % (a, name)) for a in self.extra_attributes])
+        o = self._add(self.objectname(name, version, type), name, version, type, owner, 'integrate', created,
+                      task=self._task_display_name(task), status_log=status_log, **attributes)
+        self.task_objects[task].append(o['objectname'])
+        for p in preds:
+            self.predecessors[o['objectname']].append(p)
+            self.successors[p].append(o['objectname'])
+        self.contents[o['objectname']] = ''.join(['%s version %s line %d\n' % (name, version, i) for i in range(20)])
+        return o['objectname']
+
+    def _create_files(self, objects, versions, releases, depth, merge_frequency):
+        # directories, one version each, in both projects
+        dirs = {'prod': ['prod'], 'lib': ['lib']}
+        for i in range(max(1, depth) * 3):
+            project = 'prod' if i % 3 else 'lib'
+            parent = self.rng.choice([d for d in dirs[project] if d.count('/') < depth])
+            dirs[project].append(parent + '/d%d' % i)
+        dir_objects = {}
+        for project in dirs:
+            for path in dirs[project][1:]:
+                dir_objects[path] = self._create_version(path.split('/')[-1], '1', 'dir', 0, [])
+
+        for i in range(objects):
+            project = 'lib' if i % 10 < 3 else 'prod'
+            directory = self.rng.choice(dirs[project])
+            name = 'file%d.c' % i
+            # release of every version, the first one is in the first release
+            version_releases = [0] + sorted([self.rng.randint(1, releases - 1) for v in range(self.rng.randint(0, versions - 1))]) if releases > 1 else [0]
+            released = []
+            previous = None
+            for v, k in enumerate(version_releases):
+                preds = [previous] if previous else []
+                if previous and self.rng.random() < merge_frequency:
+                    # a parallel version merged back into this one
+                    preds.append(self._create_version(name, '%d.1' % v, 'ascii', k, [previous]))
+                previous = self._create_version(name, str(v + 1), 'ascii', k, preds)
+                released.append((k, previous))
+            for k in range(releases):
+                version = [o for r, o in released if r <= k][-1]
+                project_object = self.sub[k] if project == 'lib' else self.top[k]
+                parent = dir_objects[directory] if directory in dir_objects else project_object
+                self._add_member(version, parent, project_object, directory + '/' + name)
+
+        for k in range(releases):
+            for path, d in dir_objects.items():
+                project_object = self.sub[k] if path.startswith('lib') else self.top[k]
+                parent_path = path.rsplit('/', 1)[0]
+                parent = dir_objects[parent_path] if parent_path in dir_objects else project_object
+                self._add_member(d, parent, project_object, path)
+
+    def save(self, fname):
+        self.rng = None
+        f = open(fname, 'wb')
+        cPickle.dump(self, f, cPickle.HIGHEST_PROTOCOL)
+        f.close()
+
+    @staticmethod
+    def load(fname):
+        f = open(fname, 'rb')
+        db = cPickle.load(f)
+        f.close()
+        return db
+
+    def lookup(self, name):
+        """The objectname of an objectname or of a task display name like db1#12"""
+        if '#' in name:
+            return self.objectname('task' + name.split('#')[1], '1', 'task')
+        return name
+
+    def index(self, attribute):
+        """{value: objectnames} of an attribute, built on first use"""
+        if attribute not in self.indexes:
+            index = {}
+            for n, o in self.objects.iteritems():
+                index.setdefault(o.get(attribute), []).append(n)
+            self.indexes[attribute] = index
+        return self.indexes[attribute]
+
+    # Relations used by the query functions
+
+    def recursive_members(self, project):
+        result = set()
+        todo = [project]
+        while todo:
+            for o in self.members.get(todo.pop(), []):
+                if o not in result:
+                    result.add(o)
+                    if o in self.members:
+                        todo.append(o)
+        return result
+
+    def projects_with_member(self, objectname):
+        return set([p for p, m in self.members.iteritems() if objectname in m])
+
+
+class QueryEvaluator(object):
+    """Evaluates the ccm query language, as far as this code base uses it, on a SyntheticDatabase"""
+
+    token = re.compile(r"\s*(?:('[^']*'|\"[^\"]*\")|(\(|\)|,)|(>=|<=|!=|=|>|<)|([A-Za-z_%][\w%#.:\-/]*))")
+
+    def __init__(self, db):
+        self.db = db
+
+    def evaluate(self, query_string):
+        self.tokens = self._tokenize(query_string)
+        self.position = 0
+        result = self._expression()
+        if self.position != len(self.tokens):
+            raise ValueError('unexpected %s in query' % self.tokens[self.position][1])
+        return result
+
+    def _tokenize(self, s):
+        tokens = []
+        position = 0
+        s = s.strip()
+        while position < len(s):
+            m = self.token.match(s, position)
+            if not m or m.end() == position:
+                raise ValueError('cannot parse query at: ' + s[position:])
+            position = m.end()
+            if m.group(1):
+                tokens.append(('string', m.group(1)[1:-1]))
+            elif m.group(2):
+                tokens.append(('punct', m.group(2)))
+            elif m.group(3):
+                tokens.append(('op', m.group(3)))
+            else:
+                tokens.append(('word', m.group(4)))
+        return tokens
+
+    def _peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def _next(self):
+        t = self._peek()
+        self.position += 1
+        return t
+
+    def _expression(self):
+        result = self._term()
+        while self._peek() == ('word', 'or'):
+            self._next()
+            result = result | self._term()
+        return result
+
+    def _term(self):
+        result = self._factor()
+        while self._peek() == ('word', 'and'):
+            self._next()
+            result = result & self._factor()
+        return result
+
+    def _factor(self):
+        kind, value = self._next()
+        if (kind, value) == ('word', 'not'):
+            return set(self.db.objects) - self._factor()
+        if (kind, value) == ('punct', '('):
+            result = self._expression()
+            self._next()
+            return result
+        if self._peek() == ('punct', '('):
+            return self._call(value)
+        op = self._next()[1]
+        return self._compare(value, op, self._value())
+
+    def _value(self):
+        kind, value = self._next()
+        if kind == 'word' and self._peek() == ('punct', '('):
+            return self._call(value)
+        return value
+
+    def _call(self, function):
+        self._next()
+        args = []
+        while self._peek() != ('punct', ')'):
+            args.append(self._value())
+            if self._peek() == ('punct', ','):
+                self._next()
+        self._next()
+        if function == 'time':
+            return self._time(args[0])
+        if function == 'task':
+            return set([self.db.lookup(args[0])])
+        return getattr(self, 'q_' + function)(*args)
+
+    def _time(self, spec):
+        m = re.match('%today_minus(\d+)months', spec)
+        if m:
+            return self.db.now - timedelta(days=30 * int(m.group(1)))
+        return datetime.strptime(spec, TIME_FORMAT)
+
+    def _compare(self, attribute, op, value):
+        if op == '=' and attribute != 'create_time':
+            return set(self.db.index(attribute).get(value, ()))
+        if attribute == 'create_time':
+            key = lambda o: o['created']
+        else:
+            key = lambda o: o.get(attribute)
+        ops = {'=': lambda a, b: a == b, '!=': lambda a, b: a != b, '>': lambda a, b: a > b,
+               '<': lambda a, b: a < b, '>=': lambda a, b: a >= b, '<=': lambda a, b: a <= b}
+        return set([n for n, o in self.db.objects.iteritems() if ops[op](key(o), value)])
+
+    def _names(self, arg):
+        if isinstance(arg, set):
+            return arg
+        return set([arg])
+
+    def q_recursive_is_member_of(self, project, option='none'):
+        result = set()
+        for p in self._names(project):
+            result |= self.db.recursive_members(p)
+        return result
+
+    def q_is_member_of(self, project):
+        result = set()
+        for p in self._names(project):
+            result |= self.db.members.get(p, set())
+        return result
+
+    def q_has_member(self, objectname):
+        return self.db.projects_with_member(objectname)
+
+    def q_is_predecessor_of(self, objectname):
+        return set(self.db.predecessors.get(objectname, []))
+
+    def q_is_successor_of(self, objectname):
+        return set(self.db.successors.get(objectname, []))
+
+    def q_is_baseline_project_of(self, project):
+        if project in self.db.baseline:
+            return set([self.db.baseline[project]])
+        return set()
+
+    def q_has_baseline_project(self, project):
+        return set([p for p, b in self.db.baseline.iteritems() if b == project])
+
+    def q_is_child_of(self, parent, project):
+        return set(self.db.children.get((parent, project), []))
+
+    def q_has_project_in_baseline(self, project):
+        return set()
+
+    def q_has_task_in_baseline(self, task):
+        return set()
+
+    def q_has_task_in_CUIinsp(self, task):
+        return set()
+
+    def q_is_associated_cv_of(self, task):
+        result = set()
+        for t in self._names(task):
+            result |= set(self.db.task_objects.get(t, []))
+        return result
+
+
+class SyntheticBackend(object):
+    """Answers ccm commands from a SyntheticDatabase, usable as the backend of a SynergySession.
+
+    latency is an artificial delay in seconds added to every command"""
+
+    flags = set(['-u', '-nf', '-l', '-released_proj', '-task', '-nogui', '-m', '-q'])
+
+    def __init__(self, db, latency=0.0):
+        self.db = db
+        self.latency = latency
+
+    def execute(self, command, environment):
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            return self.answer(command[1:]), ''
+        except Exception, e:
+            return '', 'Synthetic ccm cannot answer %s: %s\n' % (command[1:], e)
+
+    def _parse(self, args):
+        options = {}
+        positional = []
+        i = 0
+        while i < len(args):
+            if args[i] in self.flags:
+                options[args[i]] = True
+            elif args[i].startswith('-') and i + 1 < len(args):
+                options.setdefault(args[i], []).append(args[i + 1])
+                i += 1
+            else:
+                positional.append(args[i])
+            i += 1
+        return options, positional
+
+    def _format(self, format, objectnames):
+        def value(o, keyword):
+            v = self.db.objects[o].get(keyword, '<void>')
+            return v if isinstance(v, str) else str(v)
+        return ''.join([re.sub('%(\w+)', lambda m: value(o, m.group(1)), format) for o in sorted(objectnames)])
+
+    def answer(self, args):
+        command = args[0]
+        options, positional = self._parse(args[1:])
+        format = options.get('-f', ['%objectname|ITEM_SEPARATOR|'])[0]
+        db = self.db
+        if command == 'start':
+            return 'synthetic:0:127.0.0.1\n'
+        if command == 'delim':
+            return db.delimiter + '\n'
+        if command == 'stop':
+            return ''
+        if command == 'query':
+            return self._format(format, QueryEvaluator(db).evaluate(positional[0]))
+        if command == 'cat':
+            return db.contents[positional[0]]
+        if command == 'attr':
+            o = db.objects[db.lookup(positional[0])]
+            if '-l' in options:
+                return ''.join(['%s (string)\n' % a for a in sorted(o) if a != 'created'])
+            return o[options['-s'][0]] + '\n'
+        if command == 'finduse':
+            o = db.lookup(positional[0])
+            lines = []
+            if '-task' in options:
+                lines.append(db.objects[o]['task_synopsis'])
+                projects = set()
+                for member in db.task_objects.get(o, []):
+                    projects |= db.projects_with_member(member)
+                lines.extend(['\t' + p for p in sorted(projects)])
+            else:
+                lines.append(o)
+                for p in sorted(db.projects_with_member(o)):
+                    lines.append('\t%s%s%s@%s' % (db.paths[(o, p)], db.delimiter, db.objects[o]['version'], p))
+            return '\n'.join(lines) + '\n'
+        if command == 'hist':
+            items = []
+            families = set()
+            for o in positional:
+                family = (db.objects[o]['name'], db.objects[o]['type'])
+                if family in families:
+                    continue
+                families.add(family)
+                for v in sorted(db.objects):
+                    if (db.objects[v]['name'], db.objects[v]['type']) == family:
+                        items.append(self._format(format, [v]) + '\nPredecessors:\n\t' + '\n\t'.join(db.predecessors[v]) +
+                                     '\nSuccessors:\n\t' + '\n\t'.join(db.successors[v]) + '\n' + '*' * 77 + '\n')
+            return ''.join(items)
+        if command == 'task':
+            return self._format(format, db.task_objects[db.lookup(positional[0])])
+        if command == 'rp':
+            tasks = set()
+            members = db.recursive_members(positional[0])
+            for t, objects in db.task_objects.iteritems():
+                if members.intersection(objects):
+                    tasks.add(t)
+            return self._format(format, tasks)
+        if command == 'diff':
+            return ''
+        raise ValueError('unknown command ' + command)
+
+
+def main():
+    """Act as the ccm executable, i.e. SYNTHETIC_CCM_DB=db.p [SYNTHETIC_CCM_LATENCY=0.1] synthetic_ccm.py query "..." """
+    if 'SYNTHETIC_CCM_DB' not in os.environ:
+        sys.stderr.write('synthetic_ccm.py: set SYNTHETIC_CCM_DB to a saved synthetic database\n')
+        sys.exit(1)
+    backend = SyntheticBackend(SyntheticDatabase.load(os.environ['SYNTHETIC_CCM_DB']), float(os.environ.get('SYNTHETIC_CCM_LATENCY', '0')))
+    stdout, stderr = backend.execute([sys.argv[0]] + sys.argv[1:], os.environ)
+    sys.stdout.write(stdout)
+    sys.stderr.write(stderr)
+    if stderr:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()